@@ -0,0 +1,171 @@
+import mmap     # Import to read archives without loading them into memory
+import struct   # Import to pack the binary records
+
+from KubaGame import KubaGame
+
+# Archive layout (all integers little-endian):
+#   file header : magic b'KUBA', version (u8), # of games (u32), offset of the index (u64)
+#   game record : flags (u8, bit 0 set if player2 moved first), # of plies (u32),
+#                 player1 and player2 as name length (u8) + UTF-8 name + color (1 byte),
+#                 then the plies packed 9 bits each (7-bit cell index, 2-bit direction)
+#   index       : offset (u64) of every game record, in order
+MAGIC = b'KUBA'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sBIQ')
+GAME_HEADER = struct.Struct('<BI')
+OFFSET = struct.Struct('<Q')
+DIRECTION_BITS = {'L': 0, 'R': 1, 'F': 2, 'B': 3}
+BIT_DIRECTIONS = 'LRFB'
+PLY_BITS = 9
+
+def pack_plies(moves):
+    '''Takes a list of (coordinates, direction) moves and packs them 9 bits each into bytes'''
+    packed = 0
+    for ply, (coordinates, direction) in enumerate(moves):
+        cell = coordinates[0] * 7 + coordinates[1]
+        packed |= ((cell << 2) | DIRECTION_BITS[direction]) << (ply * PLY_BITS)
+    return packed.to_bytes((len(moves) * PLY_BITS + 7) // 8, 'little')
+
+def unpack_plies(data, count):
+    '''Takes packed ply bytes and returns the first count plies as (coordinates, direction) moves'''
+    packed = int.from_bytes(data, 'little')
+    moves = []
+    for ply in range(count):
+        value = (packed >> (ply * PLY_BITS)) & 0x1FF
+        moves.append((divmod(value >> 2, 7), BIT_DIRECTIONS[value & 3]))
+    return moves
+
+class KubaArchiveWriter:
+    '''
+    KubaArchiveWriter writes played games into the compact binary archive format
+    described above. Only accepted moves are stored (the players take turns), so a
+    ply takes 9 bits. Use as a context manager or call close() to write the index.
+    Only games on the official 7x7 board fit the 7-bit cell index.
+    '''
+
+    def __init__(self, path):
+        '''Takes the path of the archive to create (an existing file is overwritten)'''
+        self._file = open(path, 'wb')
+        self._offsets = []
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_game(self, player1, player2, moves, size=7):
+        '''
+        Takes the two (name, color) player tuples as passed to KubaGame, the list of
+        accepted moves as (player name, coordinates, direction) and the board size, and
+        appends the game. Raises ValueError if the players do not take turns, if a color
+        is not W or B, or if the game does not fit the format: a board other than 7x7, a
+        cell off the board or an unknown direction (they would overflow into the next ply).
+        '''
+        if size != 7:
+            raise ValueError('Only games on a 7x7 board fit the archive, not %rx%r' % (size, size))
+        first_mover = moves[0][0] if moves else player1[0]
+        names = (player1[0], player2[0])
+        for ply, (player_name, coordinates, direction) in enumerate(moves):
+            if player_name != names[(names.index(first_mover) + ply) % 2]:
+                raise ValueError('Ply %d is not played by the player whose turn it is' % ply)
+            row, col = coordinates
+            if not (isinstance(row, int) and isinstance(col, int) and 0 <= row < 7 and 0 <= col < 7):
+                raise ValueError('Ply %d is off the 7x7 board: %r' % (ply, coordinates))
+            if direction not in DIRECTION_BITS:
+                raise ValueError('Ply %d has an unknown direction %r' % (ply, direction))
+        flags = 1 if first_mover == player2[0] else 0
+        record = [GAME_HEADER.pack(flags, len(moves))]
+        for name, color in (player1, player2):
+            encoded = name.encode('utf-8')
+            if len(encoded) > 255:
+                raise ValueError('Player name %r is too long for the archive' % name)
+            if color not in ('W', 'B'):
+                raise ValueError('Player color %r is not W or B' % (color,))
+            record.append(bytes([len(encoded)]) + encoded + color.encode('ascii'))
+        record.append(pack_plies([(coordinates, direction) for _, coordinates, direction in moves]))
+        self._offsets.append(self._file.tell())
+        self._file.write(b''.join(record))
+
+    def close(self):
+        '''Writes the index of offsets and the final file header, then closes the file'''
+        if self._file.closed:
+            return
+        index_offset = self._file.tell()
+        self._file.write(b''.join(OFFSET.pack(offset) for offset in self._offsets))
+        self._file.seek(0)
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, len(self._offsets), index_offset))
+        self._file.close()
+
+class KubaArchiveReader:
+    '''
+    KubaArchiveReader memory-maps an archive written by KubaArchiveWriter. Only the
+    header, the index entry and the record of the requested game are touched, so any
+    game (or any ply within a game) can be rebuilt as a KubaGame without reading the
+    whole file.
+    '''
+
+    def __init__(self, path):
+        '''Takes the path of the archive to open. Raises ValueError if it is not an archive'''
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count, self._index_offset = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a Kuba archive (version %d)' % (path, VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        '''Closes the memory map and the file'''
+        self._map.close()
+        self._file.close()
+
+    def read_header(self, index):
+        '''Returns (player1, player2, first mover's name, # of plies, offset of the plies) of a game'''
+        if not 0 <= index < self._count:
+            raise IndexError('Game %d is not in the archive' % index)
+        offset = OFFSET.unpack_from(self._map, self._index_offset + index * OFFSET.size)[0]
+        flags, count = GAME_HEADER.unpack_from(self._map, offset)
+        offset += GAME_HEADER.size
+        players = []
+        for _ in range(2):
+            length = self._map[offset]
+            name = self._map[offset + 1:offset + 1 + length].decode('utf-8')
+            color = chr(self._map[offset + 1 + length])
+            players.append((name, color))
+            offset += length + 2
+        first_mover = players[flags & 1][0]
+        return players[0], players[1], first_mover, count, offset
+
+    def get_moves(self, index, plies=None):
+        '''
+        Returns the moves of a game as (player name, coordinates, direction), only the first
+        plies moves if given. Only the bytes of those plies are read.
+        '''
+        player1, player2, first_mover, count, offset = self.read_header(index)
+        if plies == None or plies > count:
+            plies = count
+        data = self._map[offset:offset + (plies * PLY_BITS + 7) // 8]
+        names = (first_mover, player2[0] if first_mover == player1[0] else player1[0])
+        return [(names[ply % 2], coordinates, direction)
+                for ply, (coordinates, direction) in enumerate(unpack_plies(data, plies))]
+
+    def get_game(self, index, plies=None):
+        '''
+        Rebuilds a game of the archive as a KubaGame, replayed up to the given # of plies
+        (the whole game if None).
+        '''
+        player1, player2 = self.read_header(index)[:2]
+        game = KubaGame(player1, player2)
+        for player_name, coordinates, direction in self.get_moves(index, plies):
+            game.make_move(player_name, coordinates, direction)
+        return game
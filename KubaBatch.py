@@ -0,0 +1,191 @@
+import numpy as np      # Import for the vectorized board arrays (pip install numpy)
+
+from KubaGame import KubaBoard
+
+# Cell values of the board arrays
+EMPTY, WHITE, BLACK, RED = 0, 1, 2, 3
+MARBLE_CODES = {'X': EMPTY, 'W': WHITE, 'B': BLACK, 'R': RED}
+DIRECTION_CODES = {'L': 0, 'R': 1, 'F': 2, 'B': 3}
+
+def build_line_table():
+    '''
+    Returns two arrays indexed by [direction, row, col]: the 7 flat cell indices
+    (row * 7 + col) of the line through the cell, ordered in the direction of the push,
+    and the position of the cell within that line.
+    '''
+    line_cells = np.zeros((4, 7, 7, 7), dtype=np.intp)
+    line_pos = np.zeros((4, 7, 7), dtype=np.intp)
+    for row in range(0, 7):
+        for col in range(0, 7):
+            line_cells[0, row, col] = [row * 7 + i for i in range(6, -1, -1)]   # L: right to left
+            line_pos[0, row, col] = 6 - col
+            line_cells[1, row, col] = [row * 7 + i for i in range(0, 7)]        # R: left to right
+            line_pos[1, row, col] = col
+            line_cells[2, row, col] = [i * 7 + col for i in range(6, -1, -1)]   # F: bottom to top
+            line_pos[2, row, col] = 6 - row
+            line_cells[3, row, col] = [i * 7 + col for i in range(0, 7)]        # B: top to bottom
+            line_pos[3, row, col] = row
+    return line_cells, line_pos
+
+LINE_CELLS, LINE_POS = build_line_table()
+LINE_INDEX = np.arange(7)
+
+class KubaBatch:
+    '''
+    KubaBatch steps many independent Kuba games at once with NumPy. The boards are
+    stored as an (N, 7, 7) int8 array (EMPTY, WHITE, BLACK or RED per cell) and every
+    call to step applies one move per game following the same rules as
+    KubaGame.make_move: turn order, the push and slide of the line, pushing marbles off
+    the edge, counting captured red marbles, the ko rule, and the win conditions.
+
+    Players are identified by their marble color (WHITE or BLACK) instead of by name.
+    Superko is not supported.
+    '''
+
+    def __init__(self, n_games):
+        '''
+        Initializes n_games games, all set to the initial KubaBoard setup with blank turn
+        (either color can start), no red marbles captured and no winner.
+        '''
+        start = np.array([[MARBLE_CODES[marble] for marble in row]
+                          for row in KubaBoard().get_board_state().values()], dtype=np.int8)
+        self._boards = np.repeat(start[None], n_games, axis=0)     # Current board of each game
+        self._ko_boards = self._boards.copy()                       # Board before the last move (ko rule)
+        self._counters = np.zeros(n_games, dtype=np.int64)          # Turn # of each game
+        self._current_turns = np.zeros(n_games, dtype=np.int8)      # Color to move, 0 if anyone can start
+        self._captures = np.zeros((n_games, 2), dtype=np.int64)     # Red marbles captured by WHITE, BLACK
+        self._winners = np.zeros(n_games, dtype=np.int8)            # Winning color, 0 if no winner yet
+
+    def get_boards(self):
+        '''Returns the (N, 7, 7) array of the current boards'''
+        return self._boards
+
+    def get_captures(self):
+        '''Returns the (N, 2) array of red marbles captured by WHITE and BLACK'''
+        return self._captures
+
+    def get_winners(self):
+        '''Returns the array of the winning color of each game (0 if no winner yet)'''
+        return self._winners
+
+    def get_current_turns(self):
+        '''Returns the array of the color to move in each game (0 if anyone can start)'''
+        return self._current_turns
+
+    def get_game_counters(self):
+        '''Returns the array of the turn # of each game'''
+        return self._counters
+
+    def get_marble_counts(self):
+        '''Returns the (N, 3) array of the # of White, Black and Red marbles on each board'''
+        flat = self._boards.reshape(len(self._boards), 49)
+        return np.stack([(flat == color).sum(axis=1) for color in (WHITE, BLACK, RED)], axis=1)
+
+    def push_candidates(self, games, colors, rows, cols, directions):
+        '''
+        Takes arrays describing M candidate moves (game index, color moving, row, col and
+        direction code of each) and works out each push without changing the boards.
+        Returns the legal mask of the candidates, the flat cell indices of the line pushed,
+        the line after the push, and the marble pushed off (EMPTY if none). Candidates
+        off the board, of a color other than WHITE or BLACK, or with an unknown direction
+        code are not legal (they are looked up as cell (0, 0) pushed L).
+        '''
+        flat = self._boards.reshape(len(self._boards), 49)
+        on_board = (rows >= 0) & (rows < 7) & (cols >= 0) & (cols < 7)
+        known = ((colors == WHITE) | (colors == BLACK)) & (directions >= 0) & (directions < 4)
+        rows = np.where(on_board, rows, 0)
+        cols = np.where(on_board, cols, 0)
+        directions = np.where(known, directions, 0)
+        cells = LINE_CELLS[directions, rows, cols]                  # (M, 7)
+        pos = LINE_POS[directions, rows, cols][:, None]             # (M, 1)
+        line = flat[games[:, None], cells]
+
+        # Checks 2, 4, 6-8) game not over, player's turn, own marble, cell pushed from is empty
+        turn = self._current_turns[games]
+        legal = on_board & known & (self._winners[games] == 0) & ((turn == colors) | (turn == 0))
+        legal &= np.take_along_axis(line, pos, axis=1)[:, 0] == colors
+        behind = np.take_along_axis(line, np.maximum(pos - 1, 0), axis=1)[:, 0]
+        legal &= (pos[:, 0] == 0) | (behind == EMPTY)
+
+        # Slide the marbles from pos up to the first empty cell, or push the last one off the edge
+        empty_ahead = (line == EMPTY) & (LINE_INDEX >= pos)
+        has_empty = empty_ahead.any(axis=1)
+        end = np.where(has_empty, empty_ahead.argmax(axis=1), 6)[:, None]
+        popped = np.where(has_empty, EMPTY, line[:, 6]).astype(np.int8)
+        shifted = np.concatenate([line[:, :1], line[:, :-1]], axis=1)
+        new_line = np.where((LINE_INDEX > pos) & (LINE_INDEX <= end), shifted, line)
+        new_line = np.where(LINE_INDEX == pos, EMPTY, new_line).astype(np.int8)
+        legal &= popped != colors
+
+        # Ko rule) the new board may not be the board from before the opponent's last move
+        ko_flat = self._ko_boards.reshape(len(self._ko_boards), 49)
+        diff = ko_flat != flat
+        outside_diff = diff.sum(axis=1)[games] - diff[games[:, None], cells].sum(axis=1)
+        ko_line = ko_flat[games[:, None], cells]
+        repeats = (outside_diff == 0) & (ko_line == new_line).all(axis=1) & (self._counters[games] > 0)
+        legal &= ~repeats
+        return legal, cells, new_line, popped
+
+    def step(self, colors, rows, cols, directions):
+        '''
+        Takes one move per game as arrays of length N (color moving, row, col, and
+        direction code from DIRECTION_CODES) and applies the valid ones. Invalid moves
+        leave their game untouched. Returns the per-game validity and winner arrays.
+        '''
+        colors = np.asarray(colors, dtype=np.int8)
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        directions = np.asarray(directions, dtype=np.intp)
+        games = np.arange(len(self._boards))
+        valid, cells, new_line, popped = self.push_candidates(games, colors, rows, cols, directions)
+        moved = games[valid]
+
+        # Update the boards officially and store the old ones for the ko rule
+        self._ko_boards[moved] = self._boards[moved]
+        flat = self._boards.reshape(len(self._boards), 49)
+        flat[moved[:, None], cells[valid]] = new_line[valid]
+        captured = moved[popped[valid] == RED]
+        self._captures[captured, colors[captured] - 1] += 1
+        self._counters[moved] += 1
+        self._current_turns[moved] = np.where(colors[moved] == WHITE, BLACK, WHITE)
+        self.check_game_state(moved, colors[moved])
+        return valid, self._winners.copy()
+
+    def check_game_state(self, games, colors):
+        '''
+        Takes the games that just had a move applied and the color that moved in each,
+        and updates their winners the same way as KubaGame.check_game_state.
+        '''
+        # Win scenario 1) 7 red marbles captured
+        captures = self._captures[games]
+        self._winners[games] = np.where(captures[:, 0] >= 7, WHITE, np.where(captures[:, 1] >= 7, BLACK, 0))
+        # Win scenario 2) a color ran out of marbles (checked after scenario 1, like KubaGame)
+        counts = self.get_marble_counts()[games]
+        self._winners[games] = np.where(counts[:, 0] == 0, BLACK, np.where(counts[:, 1] == 0, WHITE, self._winners[games]))
+        # Win scenario 3) the color to move next has no legal moves
+        open_mask = self._winners[games] == 0
+        open_games = games[open_mask]
+        if len(open_games):
+            stuck = ~self.legal_move_mask(open_games).reshape(len(open_games), -1).any(axis=1)
+            self._winners[open_games[stuck]] = colors[open_mask][stuck]
+
+    def legal_move_mask(self, games=None, colors=None):
+        '''
+        Returns a (len(games), 7, 7, 4) bool array of the legal moves (row, col, direction
+        code) of each game for the given colors (default: the color to move; WHITE if
+        anyone can start).
+        '''
+        if games is None:
+            games = np.arange(len(self._boards))
+        if colors is None:
+            colors = self._current_turns[games]
+            colors = np.where(colors == 0, WHITE, colors)
+        colors = np.asarray(colors, dtype=np.int8)
+        n_games = len(games)
+        # Only the cells holding the player's own marbles can be moved, so skip the rest
+        own = self._boards.reshape(len(self._boards), 49)[games] == colors[:, None]
+        cand, cells = np.nonzero(np.repeat(own, 4, axis=1))
+        rows, cols = np.divmod(cells // 4, 7)
+        legal = np.zeros((n_games, 196), dtype=bool)
+        legal[cand, cells] = self.push_candidates(games[cand], colors[cand], rows, cols, cells % 4)[0]
+        return legal.reshape(n_games, 7, 7, 4)
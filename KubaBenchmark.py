@@ -0,0 +1,174 @@
+import json     # Import to write the results and read the baseline
+import platform # Import to record the machine the results come from
+import random   # Import for the seeded random playouts
+import sys      # Import to parse the command line
+import time     # Import for the timers
+
+from KubaGame import KubaGame
+
+# Move to time for each direction, each legal from the initial board (anyone can start)
+DIRECTION_MOVES = {
+    'L': ('PlayerA', (6, 6), 'L'),
+    'R': ('PlayerA', (0, 0), 'R'),
+    'F': ('PlayerA', (6, 6), 'F'),
+    'B': ('PlayerB', (0, 6), 'B'),
+}
+
+def new_game():
+    '''Returns a new game between PlayerA (W) and PlayerB (B)'''
+    return KubaGame(('PlayerA', 'W'), ('PlayerB', 'B'))
+
+def time_calls(function, iterations):
+    '''Calls the function the given # of times and returns the total time in seconds'''
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return time.perf_counter() - start
+
+def bench_make_move(direction, iterations):
+    '''Times make_move pushing in the given direction. The games are prepared before timing'''
+    player_name, coordinates, move_direction = DIRECTION_MOVES[direction]
+    games = [new_game() for _ in range(iterations)]
+    start = time.perf_counter()
+    for game in games:
+        game.make_move(player_name, coordinates, move_direction)
+    elapsed = time.perf_counter() - start
+    if games[0].get_game_counter() != 1:
+        raise RuntimeError('Benchmark move %s was rejected' % direction)
+    return elapsed
+
+def bench_get_marble(iterations):
+    '''Times get_marble on the edge (and just off the edge) of the board; 8 lookups per iteration'''
+    game = new_game()
+    get_marble = game.get_marble
+    cells = [(0, 0), (6, 6), (0, 6), (6, 0), (-1, 3), (7, 3), (3, -1), (3, 7)]
+
+    def lookups():
+        for coordinates in cells:
+            get_marble(coordinates)
+
+    return time_calls(lookups, iterations)
+
+def bench_ko_check(iterations):
+    '''Times validate_board -> check_ko_rule on a move the ko rule rejects (nothing is changed)'''
+    game = new_game()
+    game.make_move('PlayerA', (6, 6), 'L')
+    game.make_move('PlayerB', (6, 0), 'R')
+    game.make_move('PlayerA', (6, 5), 'L')
+    game.make_move('PlayerB', (6, 1), 'R')
+    # PlayerA pushing (6, 5) left again would bring back the board from 2 turns ago
+    counter = game.get_game_counter()
+    player = game.identify_player('PlayerA')
+    board, board_hash, popped_marble = game.get_board().push_marbles((6, 5), 0, -1)
+    if not game.repeats_position(counter, board, board_hash):
+        raise RuntimeError('Benchmark position does not trigger the ko rule')
+    return time_calls(lambda: game.validate_board(counter, player, board, board_hash), iterations)
+
+def bench_marble_count(iterations):
+    '''Times get_marble_count'''
+    return time_calls(new_game().get_marble_count, iterations)
+
+def bench_playouts(iterations, seed=0):
+    '''Times full random playouts (random legal moves until there is a winner); returns (time, plies)'''
+    rng = random.Random(seed)
+    plies = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        game = new_game()
+        player_name = 'PlayerA'
+        while game.get_winner() == None:
+            moves = game.legal_moves(player_name)
+            if not moves:
+                break
+            coordinates, direction = rng.choice(moves)
+            game.make_move(player_name, coordinates, direction)
+            player_name = game.get_current_turn().get_player_name()
+            plies += 1
+    return time.perf_counter() - start, plies
+
+def run_benchmarks(scale=1.0, repeat=3):
+    '''
+    Runs every benchmark repeat times (keeping the fastest run) and returns the results by
+    name as {"ns_per_op", "ops_per_sec", "iterations"}. scale multiplies the iteration counts.
+    '''
+    iterations = {'make_move': int(20000 * scale), 'get_marble': int(50000 * scale),
+                  'ko_check': int(100000 * scale), 'marble_count': int(200000 * scale),
+                  'playout': max(1, int(20 * scale))}
+    benchmarks = {}
+    for direction in ('L', 'R', 'F', 'B'):
+        benchmarks['make_move_' + direction] = (lambda direction=direction: bench_make_move(direction, iterations['make_move']),
+                                                iterations['make_move'])
+    benchmarks['get_marble_edge'] = (lambda: bench_get_marble(iterations['get_marble']), iterations['get_marble'] * 8)
+    benchmarks['ko_check'] = (lambda: bench_ko_check(iterations['ko_check']), iterations['ko_check'])
+    benchmarks['get_marble_count'] = (lambda: bench_marble_count(iterations['marble_count']), iterations['marble_count'])
+
+    results = {}
+    for name, (benchmark, count) in benchmarks.items():
+        elapsed = min(benchmark() for _ in range(repeat))
+        results[name] = {'ns_per_op': 1e9 * elapsed / count, 'ops_per_sec': count / elapsed, 'iterations': count}
+    # Playouts are timed per ply; the same seed gives the same games every run
+    elapsed, plies = min(bench_playouts(iterations['playout']) for _ in range(repeat))
+    results['playout_ply'] = {'ns_per_op': 1e9 * elapsed / plies, 'ops_per_sec': plies / elapsed, 'iterations': plies}
+    return results
+
+def compare(results, baseline, threshold=0.10, thresholds=None):
+    '''
+    Compares results against baseline results and returns a list of regressions as
+    (name, baseline ns/op, current ns/op, slowdown ratio). A benchmark regresses when it
+    is more than its threshold (a fraction, i.e. 0.10 for 10%) slower than the baseline.
+    '''
+    thresholds = thresholds or {}
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['ns_per_op']
+        ratio = result['ns_per_op'] / before
+        if ratio > 1 + thresholds.get(name, threshold):
+            regressions.append((name, before, result['ns_per_op'], ratio))
+    return regressions
+
+def main(argv):
+    '''
+    Runs the benchmarks from the command line, i.e.
+        python KubaBenchmark.py --output results.json --baseline baseline.json --threshold 0.1
+    Exits with status 1 if any benchmark regressed against the baseline.
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(prog='KubaBenchmark.py', description='Benchmark the Kuba game rules')
+    parser.add_argument('--output', help='write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--baseline', help='compare against the results stored in this JSON file')
+    parser.add_argument('--save-baseline', help='store the results as the baseline in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown as a fraction (default 0.10)')
+    parser.add_argument('--benchmark-threshold', action='append', default=[], metavar='NAME=FRACTION',
+                        help='allowed slowdown of one benchmark, i.e. playout_ply=0.25')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the iteration counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    report = {'python': platform.python_version(), 'machine': platform.machine(),
+              'results': run_benchmarks(args.scale, args.repeat)}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as output:
+            output.write(text + '\n')
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        thresholds = {}
+        for entry in args.benchmark_threshold:
+            name, _, fraction = entry.partition('=')
+            thresholds[name] = float(fraction)
+        regressions = compare(report['results'], baseline, args.threshold, thresholds)
+        for name, before, after, ratio in regressions:
+            sys.stderr.write('REGRESSION %s: %.0f ns -> %.0f ns (%.0f%% slower)\n' % (name, before, after, 100 * (ratio - 1)))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
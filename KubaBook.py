@@ -0,0 +1,254 @@
+import mmap     # Import to look up book entries without loading the whole file
+import os       # Import to replace the book file atomically
+import struct   # Import to pack the book entries
+import sys      # Import to parse the command line
+from collections import OrderedDict
+
+from KubaGame import KubaGame, DIRECTIONS
+from KubaEngine import KubaEngine
+from KubaSymmetry import get_canonical_key, to_canonical_move, from_canonical_move
+
+# Book file layout (all integers little-endian):
+#   header  : magic b'KBOK', version (u8), # of entries (u32)
+#   entries : sorted by key, each key (u64), score (i32), search depth (u8),
+#             cell index of the move (u8, row * 7 + col) and direction (1 byte)
+# Keys are symmetry-canonical (KubaSymmetry) and moves are stored in the key's frame.
+MAGIC = b'KBOK'
+VERSION = 2
+BOOK_HEADER = struct.Struct('<4sBI')
+BOOK_ENTRY = struct.Struct('<QiBBc')
+
+def get_book_key(game, player_name):
+    '''
+    Takes a game and the name of the player to move and returns (key, transform): the
+    key of the position in the book and the transform mapping the game's moves to the
+    book's (see KubaSymmetry.get_canonical_key). Positions that are the same up to a
+    symmetry of the board and a W/B swap share one entry. Returns None if the position
+    has no key, i.e. on boards other than 7x7, which the book does not cover.
+    '''
+    if game.get_board().get_size() != 7:
+        return None
+    return get_canonical_key(game, player_name)
+
+class KubaBook:
+    '''
+    KubaBook is an opening book: the best move, score and search depth of early positions,
+    keyed by get_book_key. The book is stored in a file of entries sorted by key, which is
+    memory-mapped and binary searched, so opening a large book costs nothing up front.
+    Keys are symmetry-canonical, so mirrored and color-swapped openings share an entry.
+    Looked up entries (and misses) are kept in a bounded LRU cache in memory.
+
+    Entries added with add() are kept in memory until save() merges them into the file
+    (written to a temporary file and renamed into place). build_book fills a book with
+    deep searches of every position within a few plies of the initial setup.
+
+    The key does not include the ko boards, so lookup() only returns a move that is legal
+    in the game it is asked about.
+    '''
+
+    def __init__(self, path, cache_size=4096):
+        '''Takes the path of the book file (it is created by save() if it does not exist) and the LRU cache size'''
+        self._path = path
+        self._cache_size = cache_size
+        self._cache = OrderedDict()     # Key -> entry (or None if not in the book), least recently used first
+        self._added = {}                # Key -> entry added since the last save
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._hits = 0
+        self._misses = 0
+        self.open_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        '''Returns the # of entries in the file plus those added but not saved yet'''
+        return self._count + sum(1 for key in self._added if self.read_entry(key) == None)
+
+    def open_file(self):
+        '''Memory-maps the book file, if there is one. Raises ValueError if it is not a book'''
+        self.close()
+        if not os.path.exists(self._path):
+            return
+        self._file = open(self._path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count = BOOK_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a Kuba opening book (version %d)' % (self._path, VERSION))
+
+    def close(self):
+        '''Closes the book file (entries added but not saved are kept in memory)'''
+        if self._map != None:
+            self._map.close()
+            self._file.close()
+        self._file = None
+        self._map = None
+        self._count = 0
+
+    def get_stats(self):
+        '''Returns the # of entries, the # of cached keys and the cache hits/misses so far'''
+        return {'entries': len(self), 'cached': len(self._cache), 'hits': self._hits, 'misses': self._misses}
+
+    def read_entry(self, key):
+        '''Binary searches the book file for the key and returns its (move, score, depth) entry or None'''
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, score, depth, cell, direction = BOOK_ENTRY.unpack_from(
+                self._map, BOOK_HEADER.size + middle * BOOK_ENTRY.size)
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                return (divmod(cell, 7), direction.decode('ascii')), score, depth
+        return None
+
+    def get_entry(self, key):
+        '''Returns the (move, score, depth) entry of the key, or None if it is not in the book'''
+        if key in self._added:
+            return self._added[key]
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self._hits += 1
+            return self._cache[key]
+        self._misses += 1
+        entry = self.read_entry(key)
+        self._cache[key] = entry
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return entry
+
+    def lookup(self, game, player_name=None):
+        '''
+        Takes a game (and the player to move if no-one has made a move yet) and returns
+        the book entry of the position as a dictionary with the move, its score and the
+        depth it was searched to. Return None if the position is not in the book or the
+        book move is not legal in this game (i.e. because of the ko rule), or if the game
+        is not on a 7x7 board.
+        '''
+        if player_name == None:
+            player_name = game.get_current_turn().get_player_name()
+        book_key = get_book_key(game, player_name)
+        if book_key == None:
+            return None
+        key, transform = book_key
+        entry = self.get_entry(key)
+        if entry == None:
+            return None
+        move, score, depth = entry
+        move = from_canonical_move(move, transform)
+        if not game.check_moves(player_name, [move])[0]['legal']:
+            return None
+        return {'move': move, 'score': score, 'depth': depth}
+
+    def add(self, key, move, score, depth):
+        '''
+        Adds (or replaces, if searched at least as deep) the entry of a key, with the move
+        in the key's frame (see to_canonical_move). Kept in memory until save(). Raises
+        ValueError if the move is not on a 7x7 board, as the book only holds 7x7 positions.
+        '''
+        (row, col), direction = move
+        if not (0 <= row < 7 and 0 <= col < 7) or direction not in DIRECTIONS:
+            raise ValueError('Not a move on a 7x7 board: %r' % (move,))
+        current = self.get_entry(key)
+        if current == None or depth >= current[2]:
+            self._added[key] = (tuple(move), score, depth)
+            self._cache.pop(key, None)
+
+    def save(self):
+        '''Merges the added entries into the book file, replacing it atomically'''
+        entries = {}
+        for index in range(self._count):
+            key, score, depth, cell, direction = BOOK_ENTRY.unpack_from(
+                self._map, BOOK_HEADER.size + index * BOOK_ENTRY.size)
+            entries[key] = (divmod(cell, 7), direction.decode('ascii')), score, depth
+        entries.update(self._added)
+        data = [BOOK_HEADER.pack(MAGIC, VERSION, len(entries))]
+        for key in sorted(entries):
+            (coordinates, direction), score, depth = entries[key]
+            data.append(BOOK_ENTRY.pack(key, score, depth, coordinates[0] * 7 + coordinates[1], direction.encode('ascii')))
+        self.close()
+        with open(self._path + '.tmp', 'wb') as book_file:
+            book_file.write(b''.join(data))
+        os.replace(self._path + '.tmp', self._path)
+        self._added = {}
+        self._cache.clear()
+        self.open_file()
+
+def opening_positions(plies, player1=('PlayerA', 'W'), player2=('PlayerB', 'B')):
+    '''
+    Returns every position reachable within the given # of plies of the initial setup
+    (with either player moving first), once per book key, as a list of
+    (key, transform, game bytes, name of the player to move).
+    '''
+    positions = {}
+    frontier = []
+    for first_mover in (player1[0], player2[0]):
+        game = KubaGame(player1, player2)
+        frontier.append((game, first_mover))
+    for ply in range(plies + 1):
+        next_frontier = []
+        for game, player_name in frontier:
+            key, transform = get_book_key(game, player_name)
+            if key in positions or game.get_winner() != None:
+                continue
+            data = game.to_bytes()
+            positions[key] = (key, transform, data, player_name)
+            if ply == plies:
+                continue
+            for coordinates, direction in game.legal_moves(player_name):
+                child = KubaGame.from_bytes(data)
+                child.make_move(player_name, coordinates, direction)
+                if child.get_current_turn() != None:
+                    next_frontier.append((child, child.get_current_turn().get_player_name()))
+        frontier = next_frontier
+    return list(positions.values())
+
+def search_position(task):
+    '''Takes a (key, transform, game bytes, player name, depth, time limit) task and returns (key, transform, search result)'''
+    key, transform, data, player_name, depth, time_limit = task
+    engine = KubaEngine(max_depth=depth, time_limit=time_limit)
+    return key, transform, engine.search(KubaGame.from_bytes(data), player_name)
+
+def build_book(path, plies=2, depth=5, processes=None, time_limit=None, cache_size=4096):
+    '''
+    Fills the book at path with a search of every position within the given # of plies
+    of the initial setup, spread over a process pool. Positions already in the book at
+    the same depth or deeper are skipped. Returns the # of positions searched.
+    '''
+    from multiprocessing import Pool
+    with KubaBook(path, cache_size) as book:
+        tasks = []
+        for key, transform, data, player_name in opening_positions(plies):
+            entry = book.get_entry(key)
+            if entry == None or entry[2] < depth:
+                tasks.append((key, transform, data, player_name, depth, time_limit))
+        with Pool(processes) as pool:
+            for key, transform, result in pool.imap_unordered(search_position, tasks, chunksize=max(1, len(tasks) // 256)):
+                if result['move'] != None and result['depth'] > 0:
+                    book.add(key, to_canonical_move(result['move'], transform), result['score'], result['depth'])
+        book.save()
+    return len(tasks)
+
+def main(argv):
+    '''Builds an opening book from the command line, i.e. "python KubaBook.py book.bin --plies 2 --depth 5"'''
+    import argparse
+    parser = argparse.ArgumentParser(prog='KubaBook.py', description='Build a Kuba opening book')
+    parser.add_argument('path', help='book file to create or extend')
+    parser.add_argument('--plies', type=int, default=2, help='# of plies from the initial setup covered by the book')
+    parser.add_argument('--depth', type=int, default=5, help='search depth of every book position')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--time-limit', type=float, default=None, help='max seconds per position')
+    args = parser.parse_args(argv)
+    searched = build_book(args.path, args.plies, args.depth, args.processes, args.time_limit)
+    with KubaBook(args.path) as book:
+        print('%d positions searched, %d entries in %s' % (searched, len(book), args.path))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
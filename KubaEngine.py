@@ -0,0 +1,255 @@
+import time     # Import to keep track of the search time budget
+
+WIN_SCORE = 100000      # Score of a won position (reduced by the # of turns it takes to win)
+EXACT, LOWER, UPPER = 0, 1, 2   # Kind of score stored in the transposition table
+
+def get_opponent(game, player_name):
+    '''Takes the game and a player name and returns the name of the other player'''
+    if game.get_player1().get_player_name() == player_name:
+        return game.get_player2().get_player_name()
+    return game.get_player1().get_player_name()
+
+def evaluate_position(game, player_name):
+    '''
+    Default evaluation function of KubaEngine. Takes the game and the name of the
+    player to move and returns a score from that player's point of view (higher is
+    better) made of captured red marbles (get_captured), material on the board
+    (get_marble_count) and mobility (# of legal moves).
+    '''
+    opponent_name = get_opponent(game, player_name)
+    score = 100 * (game.get_captured(player_name) - game.get_captured(opponent_name))
+    # Material) own marbles left on the board vs the opponent's
+    white, black, red = game.get_marble_count()
+    if game.identify_player(player_name).get_player_color() == 'W':
+        score += 30 * (white - black)
+    else:
+        score += 30 * (black - white)
+    # Mobility) only known for the player to move, since legal moves depend on the turn
+    score += 2 * sum(1 for _ in game.iter_legal_moves(player_name))
+    return score
+
+class SearchAborted(Exception):
+    '''Raised inside KubaEngine when the node or time budget of the search runs out'''
+    pass
+
+class KubaEngine:
+    '''
+    KubaEngine picks a move for the player to move in a KubaGame by iterative deepening
+    alpha-beta (negamax) search. Moves are played on a fork of the game (KubaGame.fork)
+    with apply_move and taken back with undo_move, so the game searched is never touched:
+    its observers and instrumentation see none of the moves of the search.
+
+    Positions are stored in a transposition table keyed by KubaGame.get_position_hash().
+    The key does not include the ko boards, so a stored score may in rare cases ignore
+    a move the ko rule forbids; stored moves are only used once checked as legal.
+    The evaluation function can be replaced by any function taking (game, player_name).
+    With an opening book (KubaBook), positions found in the book are answered from it
+    without searching.
+    '''
+
+    def __init__(self, evaluate=evaluate_position, max_depth=4, max_nodes=None, time_limit=None, table_size=1000000,
+                 book=None):
+        '''
+        Initializes the engine with the evaluation function, the deepest search depth,
+        and the budget of the search: the max # of nodes and/or max time in seconds
+        (None for no limit). table_size is the max # of transposition table entries.
+        book is an optional KubaBook consulted before searching.
+        '''
+        self._evaluate = evaluate
+        self._max_depth = max_depth
+        self._max_nodes = max_nodes
+        self._time_limit = time_limit
+        self._table_size = table_size
+        self._book = book
+        self._table = {}            # Position hash -> (depth, score, kind of score, best move)
+        self._killers = {}          # Ply -> up to 2 moves that caused a cutoff at that ply
+        self._history = {}          # Move -> how often (weighted by depth) it caused a cutoff
+        self._nodes = 0
+        self._deadline = None
+        self._should_stop = None
+
+    def get_table(self):
+        '''Returns the transposition table of the engine'''
+        return self._table
+
+    def clear_table(self):
+        '''Empties the transposition table and the move ordering tables'''
+        self._table = {}
+        self._killers = {}
+        self._history = {}
+
+    def search(self, game, player_name=None, on_iteration=None, should_stop=None):
+        '''
+        Takes the game (and the player to move if no-one has made a move yet) and searches
+        for the best move. Returns a dictionary with the best move as (coordinates, direction),
+        its score, the depth of the last completed iteration, the # of nodes searched, the
+        time spent (in seconds), nodes per second, and whether the move came from the opening
+        book. The move is None if there are no legal moves.
+
+        on_iteration is called with the same dictionary after every completed depth, and
+        should_stop is checked along with the time limit; once it returns True the search
+        stops and returns the result of the last completed depth.
+        '''
+        if player_name == None:
+            player_name = game.get_current_turn().get_player_name()
+        start = time.perf_counter()
+        if self._book != None:
+            entry = self._book.lookup(game, player_name)
+            if entry != None:
+                return {'move': entry['move'], 'score': entry['score'], 'depth': entry['depth'], 'nodes': 0,
+                        'time': time.perf_counter() - start, 'nps': 0.0, 'book': True}
+        # Search a fork without observers or instrumentation, not the caller's game
+        game = game.fork()
+        self._nodes = 0
+        self._killers = {}
+        self._deadline = start + self._time_limit if self._time_limit != None else None
+        self._should_stop = should_stop
+        moves = game.legal_moves(player_name)
+        best_move = moves[0] if moves else None
+        best_score = None
+        completed_depth = 0
+        for depth in range(1, self._max_depth + 1):
+            if not moves:
+                break
+            try:
+                best_score, best_move = self.search_root(game, player_name, moves, depth)
+            except SearchAborted:
+                break
+            completed_depth = depth
+            if on_iteration != None:
+                on_iteration(self.get_result(best_move, best_score, completed_depth, start))
+            # A forced win (or loss) has been found, no need to go deeper
+            if abs(best_score) >= WIN_SCORE - self._max_depth:
+                break
+        self._should_stop = None
+        return self.get_result(best_move, best_score, completed_depth, start)
+
+    def get_result(self, best_move, best_score, completed_depth, start):
+        '''Returns the result dictionary of search (see search) for the search started at start'''
+        elapsed = time.perf_counter() - start
+        return {
+            'move': best_move,
+            'score': best_score,
+            'depth': completed_depth,
+            'nodes': self._nodes,
+            'time': elapsed,
+            'nps': self._nodes / elapsed if elapsed > 0 else 0.0,
+            'book': False,
+        }
+
+    def search_root(self, game, player_name, moves, depth):
+        '''Searches every root move to the given depth and returns (best score, best move)'''
+        alpha = -WIN_SCORE - 1
+        beta = WIN_SCORE + 1
+        best_move = None
+        for move in self.order_moves(game, moves, 0):
+            game.apply_move(player_name, move[0], move[1])
+            try:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, 1)
+            finally:
+                game.undo_move()
+            if best_move == None or score > alpha:
+                alpha = score
+                best_move = move
+        self.store(game, depth, alpha, EXACT, best_move)
+        return alpha, best_move
+
+    def negamax(self, game, depth, alpha, beta, ply):
+        '''
+        Returns the score of the current position of the game from the point of view of
+        the player to move, searched to the given depth within the alpha-beta window.
+        '''
+        self._nodes += 1
+        if self._max_nodes != None and self._nodes >= self._max_nodes:
+            raise SearchAborted()
+        # Only check the clock (and should_stop) every so often, it is slower than the search itself
+        if self._nodes & 255 == 0:
+            if self._deadline != None and time.perf_counter() >= self._deadline:
+                raise SearchAborted()
+            if self._should_stop != None and self._should_stop():
+                raise SearchAborted()
+
+        player_name = game.get_current_turn().get_player_name()
+        winner = game.get_winner()
+        if winner != None:
+            # Prefer quick wins and slow losses
+            return WIN_SCORE - ply if winner == player_name else ply - WIN_SCORE
+        if depth == 0:
+            return self._evaluate(game, player_name)
+
+        # Check the transposition table for a score of this position
+        key = game.get_position_hash()
+        entry = self._table.get(key)
+        table_move = None
+        if entry != None:
+            entry_depth, entry_score, entry_kind, table_move = entry
+            if entry_depth >= depth:
+                if entry_kind == EXACT:
+                    return entry_score
+                elif entry_kind == LOWER and entry_score >= beta:
+                    return entry_score
+                elif entry_kind == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        moves = game.legal_moves(player_name)
+        if not moves:
+            return ply - WIN_SCORE
+        original_alpha = alpha
+        best_score = -WIN_SCORE - 1
+        best_move = None
+        for move in self.order_moves(game, moves, ply, table_move):
+            game.apply_move(player_name, move[0], move[1])
+            try:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                game.undo_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                # Remember the move that caused the cutoff for move ordering
+                killers = self._killers.setdefault(ply, [])
+                if move not in killers:
+                    killers.insert(0, move)
+                    del killers[2:]
+                self._history[move] = self._history.get(move, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            kind = UPPER
+        elif best_score >= beta:
+            kind = LOWER
+        else:
+            kind = EXACT
+        self.store(game, depth, best_score, kind, best_move)
+        return best_score
+
+    def order_moves(self, game, moves, ply, table_move=None):
+        '''
+        Returns the moves in the order they should be searched: the transposition table
+        move first (if legal), then the killer moves of this ply, then by history score.
+        '''
+        if table_move == None:
+            entry = self._table.get(game.get_position_hash())
+            if entry != None:
+                table_move = entry[3]
+        killers = self._killers.get(ply, ())
+        history = self._history
+
+        def move_priority(move):
+            if move == table_move:
+                return 2 * WIN_SCORE
+            elif move in killers:
+                return WIN_SCORE - killers.index(move)
+            return history.get(move, 0)
+
+        return sorted(moves, key=move_priority, reverse=True)
+
+    def store(self, game, depth, score, kind, best_move):
+        '''Stores the searched score and best move of the current position in the transposition table'''
+        # Simple replacement scheme: start over once the table is full
+        if len(self._table) >= self._table_size:
+            self._table = {}
+        self._table[game.get_position_hash()] = (depth, score, kind, best_move)
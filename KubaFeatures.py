@@ -0,0 +1,250 @@
+import json     # Import to read the game records and write the shard manifest
+import os       # Import to create the output directory
+import sys      # Import to read records from stdin and parse the command line
+
+import numpy as np      # Import for the feature arrays and the .npy shards (pip install numpy)
+
+from KubaGame import KubaGame, DIRECTIONS, play_game
+from KubaEngine import get_opponent
+from KubaReplay import is_move, read_chunks, map_chunks
+
+# Feature planes of a position, all from the point of view of the player to move. The
+# capture planes hold the # of red marbles captured in every cell, the legal planes a 1 in
+# the cell of every marble the player to move can push in that direction.
+PLANES = ('own', 'opponent', 'red', 'empty', 'white_to_move', 'own_captured', 'opponent_captured',
+          'legal_L', 'legal_R', 'legal_F', 'legal_B')
+# Label columns of a position: game outcome for the player to move (1 won, -1 lost, 0
+# no winner), the move played (cell index * 4 + direction index in DIRECTIONS) and the ply
+LABELS = ('outcome', 'move', 'ply')
+MANIFEST_FILE = 'manifest.json'
+
+def position_row(game, player_name):
+    '''
+    Takes a game and the name of the player to move and returns the position as a tuple
+    of integers: own, opponent and red marble bits (bit row * size + col), whether the
+    player is 'W', both capture counts, and the legal move bits for each direction.
+    '''
+    board = game.get_board()
+    size = board.get_size()
+    white, black, red = board.get_packed_state()
+    color = game.identify_player(player_name).get_player_color()
+    legal = dict.fromkeys(DIRECTIONS, 0)
+    for (row, col), direction in game.iter_legal_moves(player_name):
+        legal[direction] |= 1 << (row * size + col)
+    own, opponent = (white, black) if color == 'W' else (black, white)
+    return (own, opponent, red, 1 if color == 'W' else 0, game.get_captured(player_name),
+            game.get_captured(get_opponent(game, player_name)), legal['L'], legal['R'], legal['F'], legal['B'])
+
+def encode_record(record, size=7):
+    '''
+    Takes a game record (a dict like the JSON lines of KubaReplay.replay_record, or such a
+    JSON line) and replays it, returning (rows, labels): the position_row and the LABELS of
+    the position before every accepted move. Rejected moves are skipped. Raises ValueError
+    for another board size, an entry that is not a move (see KubaReplay.is_move) or a
+    move by a player not in the record.
+    '''
+    if isinstance(record, str):
+        record = json.loads(record)
+    players = [tuple(player) for player in record['players']]
+    game = KubaGame(players[0], players[1], superko=record.get('superko', False), size=record.get('size'),
+                    setup=record.get('setup'), capture_target=record.get('capture_target'))
+    if game.get_board().get_size() != size:
+        raise ValueError('Game of size %d in a %dx%d export' % (game.get_board().get_size(), size, size))
+    directions = list(DIRECTIONS)
+    rows = []
+    labels = []
+    for move in record['moves']:
+        if not is_move(move):
+            raise ValueError('Not a move: %r' % (move,))
+        player_name, coordinates, direction = move
+        if game.identify_player(player_name) == None:
+            raise ValueError('Move by unknown player %r' % (player_name,))
+        row = position_row(game, player_name)
+        ply = game.get_game_counter()
+        if game.make_move(player_name, tuple(coordinates), direction):
+            rows.append(row)
+            labels.append((player_name, (coordinates[0] * size + coordinates[1]) * 4 + directions.index(direction), ply))
+    winner = game.get_winner()
+    return rows, [(0 if winner == None else 1 if winner == player_name else -1, move, ply)
+                  for player_name, move, ply in labels]
+
+def rows_to_planes(rows, size=7):
+    '''Takes a list of position_row tuples and returns their (N, len(PLANES), size, size) uint8 feature planes'''
+    cells = size * size
+    count = len(rows)
+    planes = np.zeros((count, len(PLANES), cells), dtype=np.uint8)
+    if count == 0:
+        return planes.reshape(count, len(PLANES), size, size)
+    # Unpack every bitboard of the batch at once: 3 marble planes + 4 legal move planes per position
+    board_bytes = (cells + 7) // 8
+    bitboards = [row[index] for row in rows for index in (0, 1, 2, 6, 7, 8, 9)]
+    data = b''.join(bits.to_bytes(board_bytes, 'little') for bits in bitboards)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8).reshape(count, 7, board_bytes),
+                         axis=2, bitorder='little')[:, :, :cells]
+    planes[:, 0:3] = bits[:, 0:3]
+    planes[:, 3] = 1 - (bits[:, 0] | bits[:, 1] | bits[:, 2])
+    scalars = np.array([row[3:6] for row in rows], dtype=np.uint8)
+    planes[:, 4:7] = scalars[:, :, None]
+    planes[:, 7:11] = bits[:, 3:7]
+    return planes.reshape(count, len(PLANES), size, size)
+
+def encode_chunk(task):
+    '''
+    Takes a (list of records, board size) task and returns (planes, labels, # of records
+    skipped): the arrays of the positions of all the records, leaving out bad records
+    '''
+    records, size = task
+    rows = []
+    labels = []
+    skipped = 0
+    for record in records:
+        try:
+            record_rows, record_labels = encode_record(record, size)
+        except (ValueError, KeyError, IndexError, TypeError):
+            skipped += 1
+            continue
+        rows.extend(record_rows)
+        labels.extend(record_labels)
+    return rows_to_planes(rows, size), np.array(labels, dtype=np.int32).reshape(len(labels), len(LABELS)), skipped
+
+class KubaFeatureWriter:
+    '''
+    KubaFeatureWriter writes feature planes and labels into fixed-size shards: pairs of .npy
+    files (planes-00000.npy as uint8 (N, len(PLANES), size, size), labels-00000.npy as int32
+    (N, len(LABELS))) that np.load(path, mmap_mode='r') opens without reading them. Only one
+    shard is held in memory while writing. close() writes the last (smaller) shard and the
+    manifest listing every shard; use as a context manager.
+    '''
+
+    def __init__(self, directory, size=7, shard_size=16384):
+        '''Takes the output directory (created if needed), the board size and the # of positions per shard'''
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._size = size
+        self._shard_size = shard_size
+        self._planes = np.zeros((shard_size, len(PLANES), size, size), dtype=np.uint8)
+        self._labels = np.zeros((shard_size, len(LABELS)), dtype=np.int32)
+        self._count = 0         # Positions in the current shard
+        self._shards = []       # (planes file, labels file, # of positions) of the shards written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_count(self):
+        '''Returns the # of positions added so far'''
+        return sum(shard[2] for shard in self._shards) + self._count
+
+    def add(self, planes, labels):
+        '''Takes a batch of feature planes and labels (as returned by encode_chunk) and adds it'''
+        start = 0
+        while start < len(planes):
+            take = min(len(planes) - start, self._shard_size - self._count)
+            self._planes[self._count:self._count + take] = planes[start:start + take]
+            self._labels[self._count:self._count + take] = labels[start:start + take]
+            self._count += take
+            start += take
+            if self._count == self._shard_size:
+                self.write_shard()
+
+    def write_shard(self):
+        '''Writes the positions of the current shard to its .npy files and starts the next shard'''
+        if self._count == 0:
+            return
+        index = len(self._shards)
+        planes_file = 'planes-%05d.npy' % index
+        labels_file = 'labels-%05d.npy' % index
+        np.save(os.path.join(self._directory, planes_file), self._planes[:self._count])
+        np.save(os.path.join(self._directory, labels_file), self._labels[:self._count])
+        self._shards.append((planes_file, labels_file, self._count))
+        self._count = 0
+
+    def close(self):
+        '''Writes the last shard and the manifest'''
+        self.write_shard()
+        manifest = {'size': self._size, 'planes': PLANES, 'labels': LABELS, 'positions': self.get_count(),
+                    'shards': [{'planes': planes_file, 'labels': labels_file, 'positions': count}
+                               for planes_file, labels_file, count in self._shards]}
+        with open(os.path.join(self._directory, MANIFEST_FILE), 'w') as manifest_file:
+            manifest_file.write(json.dumps(manifest, indent=2) + '\n')
+
+def export_records(records, directory, size=7, shard_size=16384, workers=1, chunk_size=256):
+    '''
+    Takes an iterable of game records (dicts or JSON lines, see encode_record) and writes the
+    features of every position to shards in directory (see KubaFeatureWriter). Records are
+    read lazily and encoded in chunks, spread over a process pool with workers > 1; at most
+    a few chunks per worker are in flight, so memory stays bounded. Returns the # of
+    positions written and of records skipped because they could not be replayed.
+    '''
+    tasks = ((chunk, size) for chunk in read_chunks(records, chunk_size))
+    skipped = 0
+    with KubaFeatureWriter(directory, size, shard_size) as writer:
+        # The chunks come back in input order, so the shards keep the order of the records
+        for planes, labels, chunk_skipped in map_chunks(encode_chunk, tasks, workers):
+            writer.add(planes, labels)
+            skipped += chunk_skipped
+    return {'positions': writer.get_count(), 'skipped': skipped}
+
+def archive_records(path):
+    '''Lazily yields the games of a KubaArchive file as game records'''
+    from KubaArchive import KubaArchiveReader
+    with KubaArchiveReader(path) as archive:
+        for index in range(len(archive)):
+            player1, player2 = archive.read_header(index)[:2]
+            yield {'players': [list(player1), list(player2)],
+                   'moves': [[player_name, list(coordinates), direction]
+                             for player_name, coordinates, direction in archive.get_moves(index)]}
+
+def self_play_records(policy1, policy2, games=100, seed=0, max_turns=1000):
+    '''Lazily plays games between two move policies (see KubaGame.get_policy) and yields their records'''
+    for index in range(games):
+        yield play_game((policy1, policy2, seed, index, max_turns, True))
+
+def load_shards(directory):
+    '''Returns the (planes, labels) arrays of every shard in directory, memory-mapped read-only'''
+    with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    return [(np.load(os.path.join(directory, shard['planes']), mmap_mode='r'),
+             np.load(os.path.join(directory, shard['labels']), mmap_mode='r'))
+            for shard in manifest['shards']]
+
+def main(argv):
+    '''
+    Exports feature planes from the command line, i.e.
+        python KubaFeatures.py out/ --records games.jsonl --workers 8
+        python KubaFeatures.py out/ --archive games.kba
+        python KubaFeatures.py out/ --self-play greedy random --games 1000
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(prog='KubaFeatures.py', description='Export Kuba positions as NumPy feature planes')
+    parser.add_argument('directory', help='output directory of the .npy shards')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--records', default='-', help='JSONL file of game records (default: stdin)')
+    source.add_argument('--archive', help='KubaArchive file of games')
+    source.add_argument('--self-play', nargs=2, metavar=('POLICY1', 'POLICY2'), help='play games between two policies')
+    parser.add_argument('--games', type=int, default=100, help='# of self-play games')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the self-play games')
+    parser.add_argument('--size', type=int, default=7)
+    parser.add_argument('--shard-size', type=int, default=16384)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args(argv)
+    source_file = None
+    if args.self_play:
+        records = self_play_records(args.self_play[0], args.self_play[1], args.games, args.seed)
+    elif args.archive:
+        records = archive_records(args.archive)
+    else:
+        source_file = sys.stdin if args.records == '-' else open(args.records)
+        records = source_file   # Blank lines are left out by KubaReplay.read_chunks
+    try:
+        result = export_records(records, args.directory, args.size, args.shard_size, args.workers, args.chunk_size)
+    finally:
+        if source_file != None and source_file is not sys.stdin:
+            source_file.close()
+    print('%d positions written to %s (%d records skipped)' % (result['positions'], args.directory, result['skipped']))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
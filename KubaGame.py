@@ -1,4 +1,117 @@
-import copy     # Import to mainly use the deepcopy function
+import copy     # Import to fork games without copying their (immutable) state
+import random   # Import to generate the Zobrist hashing keys
+import struct   # Import to pack the game state into bytes
+import sys      # Import to read the command line arguments
+import weakref  # Import to intern the player records shared by games
+
+# Random 64-bit keys used to hash the board (Zobrist hashing), one per marble color and cell.
+# Seeded so the same position hashes the same way in every process.
+_zobrist_random = random.Random(0x4B756261)
+ZOBRIST_KEYS = {color: [_zobrist_random.getrandbits(64) for _ in range(49)] for color in ('W', 'B', 'R')}
+# Extra keys for the rest of the position: color of the player to move and red marbles captured by each color
+ZOBRIST_TURN_KEYS = {'W': _zobrist_random.getrandbits(64), 'B': _zobrist_random.getrandbits(64), None: 0}
+ZOBRIST_CAPTURE_KEYS = {color: [_zobrist_random.getrandbits(64) for _ in range(50)] for color in ('W', 'B')}
+# (cell keys, capture keys) by board size; the keys of sizes other than 7 are made on first use
+ZOBRIST_TABLES = {7: (ZOBRIST_KEYS, ZOBRIST_CAPTURE_KEYS)}
+
+def get_zobrist_tables(size):
+    '''Returns the Zobrist (cell keys by color, capture keys by color) of a board size'''
+    if size not in ZOBRIST_TABLES:
+        size_random = random.Random('%d-%d' % (0x4B756261, size))
+        keys = {color: [size_random.getrandbits(64) for _ in range(size * size)] for color in ('W', 'B', 'R')}
+        capture_keys = {color: [size_random.getrandbits(64) for _ in range(size * size + 1)] for color in ('W', 'B')}
+        ZOBRIST_TABLES[size] = (keys, capture_keys)
+    return ZOBRIST_TABLES[size]
+
+# Layout of KubaGame.to_bytes after the board size, capture target and player records: turn
+# counter, current turn / winner (0 none, 1 player1, 2 player2), red marbles captured by each
+# player and the # of superko history hashes; then the board and both ko boards as (white,
+# black, red) bits, (size * size + 7) // 8 bytes each, and the superko history hashes.
+# Version 1 (7x7 boards only) stored the 9 boards as u64 before the rest and is still read.
+GAME_STATE = struct.Struct('<IBBBBI')
+GAME_STATE_V1 = struct.Struct('<9QIBBBBI')
+GAME_STATE_VERSION = 2
+
+# Row/col step of the push for each direction (F pushes towards row 0, B towards row 6)
+DIRECTIONS = {'L': (0, -1), 'R': (0, 1), 'F': (-1, 0), 'B': (1, 0)}
+
+def build_ray_tables(size=7):
+    '''
+    Takes the board size and returns the ray tables used by KubaBoard.push_marbles, both
+    keyed by the (row_step, col_step) of a direction and then by cell index (row * size + col):
+        rays        the cell indices from the cell up to the edge in that direction (cell first)
+        ray_masks   the bits of the first k cells of that ray, for k = 0 to len(ray)
+    '''
+    rays = {}
+    ray_masks = {}
+    for row_step, col_step in DIRECTIONS.values():
+        step_rays = []
+        step_masks = []
+        for index in range(size * size):
+            row, col = divmod(index, size)
+            ray = []
+            masks = [0]
+            while 0 <= row < size and 0 <= col < size:
+                ray.append(row * size + col)
+                masks.append(masks[-1] | 1 << (row * size + col))
+                row += row_step
+                col += col_step
+            step_rays.append(tuple(ray))
+            step_masks.append(tuple(masks))
+        rays[row_step, col_step] = tuple(step_rays)
+        ray_masks[row_step, col_step] = tuple(step_masks)
+    return rays, ray_masks
+
+RAYS, RAY_MASKS = build_ray_tables()
+# (rays, ray masks) by board size; the tables of sizes other than 7 are made on first use
+RAY_TABLES = {7: (RAYS, RAY_MASKS)}
+
+def get_ray_tables(size):
+    '''Returns the (rays, ray masks) tables of build_ray_tables for a board size'''
+    if size not in RAY_TABLES:
+        RAY_TABLES[size] = build_ray_tables(size)
+    return RAY_TABLES[size]
+
+def get_default_setup(size=7):
+    '''
+    Takes an odd board size (5 or more) and returns the initial setup as a list of rows
+    (strings of 'W', 'B', 'R' and 'X'). For 7x7 this is the official setup, and larger
+    boards scale it up: a block of W and B marbles in each corner (W top left and bottom
+    right) and a diamond of red marbles in the middle.
+    '''
+    if size < 5 or size % 2 == 0:
+        raise ValueError('The default setup needs an odd board size of 5 or more, not %r' % (size,))
+    block = (size - 1) // 3         # Width of the corner blocks
+    radius = size // 2 - 1          # Radius of the red diamond
+    center = size // 2
+    rows = []
+    for row in range(size):
+        cells = []
+        for col in range(size):
+            top, left = row < block, col < block
+            bottom, right = row >= size - block, col >= size - block
+            if (top and left) or (bottom and right):
+                cells.append('W')
+            elif (top and right) or (bottom and left):
+                cells.append('B')
+            elif abs(row - center) + abs(col - center) <= radius:
+                cells.append('R')
+            else:
+                cells.append('X')
+        rows.append(''.join(cells))
+    return rows
+
+# Reasons make_move rejects a move, in the order they are checked ('ko rule' covers superko too)
+REJECTION_REASONS = ('unknown player', 'game over', 'bad direction', 'wrong turn', 'not own marble',
+                     'blocked', 'own marble pushed off', 'ko rule')
+
+# State of a KubaGame that hibernate() packs into bytes (everything to_bytes covers, plus the undo stack)
+HIBERNATED_SLOTS = ('_player1', '_player2', '_board', '_capture_target', '_odd_turn_board', '_even_turn_board',
+                    '_odd_turn_hash', '_even_turn_hash', '_superko', '_position_history', '_history_shared',
+                    '_undo_stack', '_game_turn_counter', '_current_turn', '_player1_count', '_player2_count', '_winner')
+
+# (name, color) -> KubaPlayer shared by the games between these players (see KubaPlayer.intern)
+PLAYER_RECORDS = weakref.WeakValueDictionary()
 
 class KubaGame:
     '''
@@ -12,9 +125,17 @@ class KubaGame:
     Several getter/setter methods are implemented to check & change the private 
     data member(s) of the class instance. 
 
+    Games are kept small for hosting many at once: attributes are slots, the boards are
+    packed into integers, and players with the same name and color share one KubaPlayer
+    record. An idle game can also be hibernated (see hibernate).
     '''
 
-    def __init__(self, player1, player2):
+    __slots__ = ('_player1', '_player2', '_board', '_capture_target', '_odd_turn_board', '_even_turn_board',
+                 '_odd_turn_hash', '_even_turn_hash', '_superko', '_position_history', '_history_shared',
+                 '_undo_stack', '_game_turn_counter', '_current_turn', '_player1_count', '_player2_count',
+                 '_winner', '_instrumentation', '_observers', '_event_seq', '_keyframe_interval', '_hibernated')
+
+    def __init__(self, player1, player2, superko=False, debug=False, size=None, setup=None, capture_target=None):
         '''
         Initializes the KubaGame class instance by taking 2 tuples parameters (containing 
         player name and color of marble). Sets the two players in game (via KubaPlayer)
@@ -22,18 +143,47 @@ class KubaGame:
         of board as the prev board state for future reference). 
         
         Also initializes the game with blank turn (anyone can start), player's
-        red marble count as 0, and winner as None.
+        red marble count as 0, and winner as None. Raises ValueError unless one
+        player has the 'W' marbles and the other the 'B' marbles.
+
+        If superko is True, a move may not recreate ANY earlier position of the game
+        (instead of only the position from two turns ago). If debug is True, the board
+        cross-checks its running marble counts against a full scan (see KubaBoard).
+
+        size and setup choose another board size and/or a custom starting position (see
+        KubaBoard). capture_target is the # of red marbles a player must capture to win:
+        7 on the official board, and by default a majority of the red marbles of the setup.
+        Raises ValueError if capture_target is not from 1 to 255 (to_bytes stores it in one byte).
         '''
-        self._player1 = KubaPlayer(player1)
-        self._player2 = KubaPlayer(player2)
-        self._board = KubaBoard()
-        self._odd_turn_board = copy.deepcopy(self.get_board().get_board_state())  # Local copy of the board used for ko rule check
-        self._even_turn_board = copy.deepcopy(self.get_board().get_board_state()) # Local copy of the board used for ko rule check
+        self._hibernated = None         # Bytes of the game while it is hibernated (see hibernate)
+        self._player1 = KubaPlayer.intern(player1)
+        self._player2 = KubaPlayer.intern(player2)
+        if self._player1.get_player_color() == self._player2.get_player_color():
+            raise ValueError('The players must have different marble colors')
+        self._board = KubaBoard(debug, size, setup)
+        if capture_target == None:
+            capture_target = self.get_board().get_marble_count()[2] // 2 + 1
+        if not 1 <= capture_target <= 255:
+            raise ValueError('The capture target must be from 1 to 255, not %r' % (capture_target,))
+        self._capture_target = capture_target   # Red marbles needed to win
+        self._odd_turn_board = self.get_board().get_packed_state()  # Packed copy of the board used for ko rule check
+        self._even_turn_board = self._odd_turn_board                # Packed copy of the board used for ko rule check
+        self._odd_turn_hash = self.get_board().get_hash()       # Hash of the odd turn board used for ko rule check
+        self._even_turn_hash = self.get_board().get_hash()      # Hash of the even turn board used for ko rule check
+        self._superko = superko                                 # Whether any repeated position is rejected
+        # Hashes of every position so far (superko only)
+        self._position_history = {self.get_board().get_hash()} if superko else None
+        self._history_shared = False    # Whether the position history is shared with a fork (copied before a change)
+        self._undo_stack = []           # Undo records of the moves made through apply_move
         self._game_turn_counter = 0     # Tracks what turn it is; used for board state updating purpo
         self._current_turn = None       # Stores the player class intance for the current turn
         self._player1_count = 0         # Counts the number of 'R' marbles captured by player 1
         self._player2_count = 0         # Counts the number of 'R' marbles captured by player 2
         self._winner = None             # Will store the winner's player name once game is over
+        self._instrumentation = None    # Records stage timings and rejections of make_move (see set_instrumentation)
+        self._observers = ()            # Callbacks receiving the move events (see add_observer)
+        self._event_seq = 0             # Sequence # of the last move event
+        self._keyframe_interval = 64    # A keyframe event follows every this many move events
 
     def get_player1(self):
         '''Returns the 1st player in game'''
@@ -62,13 +212,17 @@ class KubaGame:
         '''Returns the board (KubaBoard) class instance'''
         return self._board     
 
+    def get_capture_target(self):
+        '''Returns the # of red marbles a player must capture to win'''
+        return self._capture_target
+
     def get_odd_board(self):
         '''Returns the previous state of board on previous odd turns (1,3,5,etc.)'''
-        return self._odd_turn_board
+        return KubaBoard.unpack_state(self._odd_turn_board, self.get_board().get_size())
 
     def get_even_board(self):
         '''Returns the previous state of board on previous even turns (0,2,4,etc.)'''
-        return self._even_turn_board        
+        return KubaBoard.unpack_state(self._even_turn_board, self.get_board().get_size())        
 
     def print_board(self,board):
         '''FOR DEBUG ONLY. Prints out the board to the console'''
@@ -89,9 +243,73 @@ class KubaGame:
         to be referenced later in the game.
         '''
         if counter % 2 == 0:
-            self._even_turn_board = self.get_board().get_board_state().copy()
+            self._even_turn_board = self.get_board().get_packed_state()
+            self._even_turn_hash = self.get_board().get_hash()
         elif counter % 2 == 1:
-            self._odd_turn_board = self.get_board().get_board_state().copy()
+            self._odd_turn_board = self.get_board().get_packed_state()
+            self._odd_turn_hash = self.get_board().get_hash()
+        if self._superko:
+            self.own_position_history()
+            self._position_history.add(self.get_board().get_hash())
+
+    def own_position_history(self):
+        '''Copies the superko position history before it is changed, if it is shared with a fork'''
+        if self._history_shared:
+            self._position_history = set(self._position_history)
+            self._history_shared = False
+
+    def fork(self):
+        '''
+        Returns an independent copy of the game to try out moves on. The boards are packed
+        into integers and the players never change, so the fork shares them with this game
+        instead of copying them; the only thing copied is the board's marble count, the
+        undo stack (a list of references) and, once either game moves, the superko history.
+        The fork has no observers and no instrumentation.
+        '''
+        game = copy.copy(self)
+        game._board = self.get_board().fork()
+        game._undo_stack = list(self._undo_stack)
+        game._instrumentation = None
+        game._observers = ()
+        game._event_seq = 0
+        if self._superko:
+            self._history_shared = game._history_shared = True
+        return game
+
+    def hibernate(self):
+        '''
+        Packs the state of an idle game into bytes (see to_bytes) and drops everything else,
+        so the game only keeps a few dozen bytes of state besides its object. The game
+        wakes up by itself on the next use (make_move, or any other method). The undo
+        stack is dropped; observers and instrumentation are kept.
+        '''
+        if self._hibernated != None:
+            return
+        data = self.to_bytes()
+        for name in HIBERNATED_SLOTS:
+            delattr(self, name)
+        self._hibernated = data
+        # Only hibernated games go through __getattr__, awake ones keep the fast attribute lookup
+        self.__class__ = HibernatedKubaGame
+
+    def is_hibernated(self):
+        '''Returns whether the game is hibernated'''
+        return self._hibernated != None
+
+    def rehydrate(self):
+        '''Unpacks the state of a hibernated game (called on the first use after hibernate)'''
+        data = self._hibernated
+        if data == None:
+            return
+        game = KubaGame.from_bytes(data)
+        for name in HIBERNATED_SLOTS:
+            setattr(self, name, getattr(game, name))
+        self._hibernated = None
+        self.__class__ = KubaGame
+
+    def is_superko(self):
+        '''Returns whether the game rejects every repeated position (superko) or only the ko rule'''
+        return self._superko
 
     def get_current_turn(self):
         '''Returns the current turn's player. Return None if no-one has made move'''
@@ -127,6 +345,93 @@ class KubaGame:
         elif self.get_player2().get_player_name() == player_name:
             return self._player2_count
 
+    def get_position_hash(self):
+        '''
+        Returns a 64-bit hash of the position: the board, the color of the player to
+        move, and the red marbles captured by each color. The hash is the same in every
+        process, so it can be used as a key for tables saved to disk.
+        '''
+        current_turn = self.get_current_turn()
+        capture_keys = get_zobrist_tables(self.get_board().get_size())[1]
+        position_hash = self.get_board().get_hash()
+        position_hash ^= ZOBRIST_TURN_KEYS[current_turn.get_player_color() if current_turn else None]
+        position_hash ^= capture_keys[self.get_player1().get_player_color()][self._player1_count]
+        position_hash ^= capture_keys[self.get_player2().get_player_color()][self._player2_count]
+        return position_hash
+
+    def to_bytes(self):
+        '''
+        Returns the whole state of the game (board size, capture target, players, board,
+        ko boards, turn counter, current turn, captured counts, winner and superko history)
+        packed into bytes, which KubaGame.from_bytes turns back into an identical game.
+        The undo stack of apply_move is not included.
+        '''
+        players = (self.get_player1(), self.get_player2())
+        size = self.get_board().get_size()
+        flags = (1 if self._superko else 0) | (2 if self.get_board().is_debug() else 0)
+        data = [bytes([GAME_STATE_VERSION, flags, size, self._capture_target])]
+        for player in players:
+            name = player.get_player_name().encode('utf-8')
+            data.append(struct.pack('<H', len(name)) + name + player.get_player_color().encode('ascii'))
+        history = sorted(self._position_history) if self._superko else []
+        data.append(GAME_STATE.pack(self._game_turn_counter,
+                                    players.index(self._current_turn) + 1 if self._current_turn else 0,
+                                    self._player1_count, self._player2_count,
+                                    players.index(self._winner) + 1 if self._winner else 0, len(history)))
+        board_bytes = (size * size + 7) // 8
+        for color_bits in (*self.get_board().get_packed_state(), *self._odd_turn_board, *self._even_turn_board):
+            data.append(color_bits.to_bytes(board_bytes, 'little'))
+        data.append(struct.pack('<%dQ' % len(history), *history))
+        return b''.join(data)
+
+    @staticmethod
+    def from_bytes(data):
+        '''Takes bytes made by to_bytes and returns the game they describe. Raises ValueError if they are not valid'''
+        try:
+            version, flags = data[0], data[1]
+            if version == 1:
+                # Version 1 only held 7x7 games with the official capture target
+                size, capture_target, offset = 7, 7, 2
+            elif version == GAME_STATE_VERSION:
+                size, capture_target, offset = data[2], data[3], 4
+            else:
+                raise ValueError('Unknown game state version %d' % version)
+            players = []
+            for _ in range(2):
+                length = struct.unpack_from('<H', data, offset)[0]
+                name = bytes(data[offset + 2:offset + 2 + length]).decode('utf-8')
+                color = chr(data[offset + 2 + length])
+                players.append((name, color))
+                offset += length + 3
+            if version == 1:
+                state = GAME_STATE_V1.unpack_from(data, offset)
+                boards, state = state[:9], state[9:]
+                offset += GAME_STATE_V1.size
+            else:
+                state = GAME_STATE.unpack_from(data, offset)
+                offset += GAME_STATE.size
+                board_bytes = (size * size + 7) // 8
+                if len(data) < offset + 9 * board_bytes:
+                    raise ValueError('Not a valid game state: the boards are cut short')
+                boards = [int.from_bytes(data[offset + index * board_bytes:offset + (index + 1) * board_bytes], 'little')
+                          for index in range(9)]
+                offset += 9 * board_bytes
+            history = struct.unpack_from('<%dQ' % state[-1], data, offset)
+        except (IndexError, struct.error, UnicodeDecodeError) as error:
+            raise ValueError('Not a valid game state: %s' % error)
+        game = KubaGame(players[0], players[1], superko=bool(flags & 1), debug=bool(flags & 2),
+                        size=size, setup=[['X'] * size] * size, capture_target=capture_target)
+        game.get_board().set_packed_state(tuple(boards[0:3]))
+        game._odd_turn_board, game._odd_turn_hash = tuple(boards[3:6]), KubaBoard.hash_state(boards[3:6], size)
+        game._even_turn_board, game._even_turn_hash = tuple(boards[6:9]), KubaBoard.hash_state(boards[6:9], size)
+        game._game_turn_counter = state[0]
+        game._current_turn = (None, game.get_player1(), game.get_player2())[state[1]]
+        game._player1_count, game._player2_count = state[2], state[3]
+        game._winner = (None, game.get_player1(), game.get_player2())[state[4]]
+        if game._superko:
+            game._position_history = set(history)
+        return game
+
     def add_captured(self, player):
         '''
         Takes the player class instance and compare to the players.
@@ -144,320 +449,301 @@ class KubaGame:
         update the board accordingly, update the player for next turn, and return True.
         If invalid (after checking through different invalid scenarios), return False
         and do NOT update the player for next turn (the same player may make the move again).
+
+        If an instrumentation object is set (see set_instrumentation), the time spent in
+        each stage of the move and the reason of every rejected move are recorded on it.
+        '''
+        instrumentation = self._instrumentation
+        if instrumentation == None:
+            return self.perform_move(player_name, coordinates, direction)
+        instrumentation.start_move()
+        accepted = self.perform_move(player_name, coordinates, direction)
+        instrumentation.end_move(player_name, coordinates, direction, accepted)
+        return accepted
+
+    def perform_move(self, player_name, coordinates, direction):
+        '''
+        Does the work of make_move in stages: checks 1-8 (check_move), the push, then
+        resolve_push -> validate_board -> check_ko_rule -> accept_board -> check_game_state.
+        The end of each stage is marked on the instrumentation, if any.
+        '''
+        # Checks 1-8) Check the player, turn, direction and marble before touching the board
+        reason = self.check_move(player_name, coordinates, direction)
+        if self._instrumentation != None:
+            self._instrumentation.end_stage('checks')
+        if reason != None:
+            return self.reject_move(reason)
+        # Move is safe to do. Perform.
+        player = self.identify_player(player_name)
+        row_step, col_step = DIRECTIONS[direction]
+        current_board, current_hash, popped_marble = self.get_board().push_marbles(coordinates, row_step, col_step)
+        if self._instrumentation != None:
+            self._instrumentation.end_stage('push')
+        return self.resolve_push(player, current_board, current_hash, popped_marble)
+
+    def check_move(self, player_name, coordinates, direction):
+        '''
+        Takes the same parameters as make_move and goes through checks 1-8 of the move
+        without changing anything. Returns the reason the move is rejected (one of
+        REJECTION_REASONS) or None if the push can be made. Whether the push would
+        send the player's own marble off the board or break the ko rule is only known
+        once the push is computed.
         '''
         # Check 1) Check whether the player name is actual player in game
-        if self.identify_player(player_name):
-            # Set the player for future reference
-            player = self.identify_player(player_name)
-            # Check 2) Check whether the game has been won or not 
-            if self.get_winner() == None:
-                # Check 3) Just in case, check whether the direction is correctly inputted
-                if direction in ['L','R','F','B']:
-                    # Check 4) Check if it's the player's turn
-                    if self.get_current_turn() == player or self.get_current_turn() == None:
-                        # Check 5) Check whether the coordinates provided is valid 
-                        if self.get_marble(coordinates) != 'X':
-                            # Check 6) Check if the marble belongs to the player
-                            if self.get_marble(coordinates):                            
-                                # Check 7) Check whether the marble at the coordinate is equal to the player's color
-                                if self.get_marble(coordinates) == player.get_player_color():                                
-                                    # Check 8) Check if the move can be made (marble has a empty space next to it)
-                                    north = self.get_marble((coordinates[0]-1,coordinates[1]))
-                                    south = self.get_marble((coordinates[0]+1,coordinates[1]))
-                                    east = self.get_marble((coordinates[0],coordinates[1]+1))
-                                    west = self.get_marble((coordinates[0],coordinates[1]-1))
-                                    # Check the directions and apply the moves accordingly 
-                                    # IF there's empty space from the direction player push the marble from
-                                    if direction == 'L':
-                                        if east == 'X':
-                                            # Move is safe to do. Perform.
-                                            current_board = copy.deepcopy(self.get_board().get_board_state())
-                                            current_board_row = current_board.get(coordinates[0]+1)                                  
-                                            # Step 1) If the left of coordinate is already empty, update accordingly
-                                            if west == 'X':
-                                                # Pop the marble to the east and insert 'X' at coordinate position
-                                                current_board_row.pop(coordinates[1]-1)
-                                                current_board_row.insert(coordinates[1], 'X')
-                                                # Update the board with the new board
-                                                counter =  self.get_game_counter()
-                                                return self.validate_board(counter, player, current_board)                                               
-                                            # Step 2) Else, check how many values to the left of the coordinate are occupied by non-X
-                                            else:
-                                                empty_pos = None
-                                                # For loop to find the 1st occurrent of 'X' to the left of non-'X' values
-                                                for i in range(coordinates[1],-1,-1):
-                                                    if current_board_row[i] == 'X':
-                                                        empty_pos = i
-                                                        break
-                                                    # If it doesn't reach this point, all values are occupied to the left.
-                                                    # We'd need to pop the index 0 value and insert 'X' at coordinate position
-                                                # Step 3a) Pop the value at the empty_pos and insert 'X' at coordinate position
-                                                if empty_pos:
-                                                    current_board_row.pop(empty_pos)
-                                                    current_board_row.insert(coordinates[1], 'X')                                        
-                                                    # Update the board with the new board
-                                                    counter = self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)                                       
-                                                # Step 3b) If all values are occupied to the left, pop left-most value and insert 'X' at coordinate position
-                                                else:
-                                                    popped_marble = current_board_row.pop(0)
-                                                    current_board_row.insert(coordinates[1], 'X')
-                                                    # If it's 'R', add to player count
-                                                    if popped_marble == 'R':
-                                                        self.add_captured(player)
-                                                    # If it's 'W' your own marble, return False (invalid)
-                                                    elif popped_marble == player.get_player_color():
-                                                        return False
-                                                    # If it's the opponent's marble, ignore (get_marble_count() will track the number on the board)
-
-                                                    # Update the board with the new board
-                                                    counter =  self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)                                            
-                                        # There's something blocking the move. Return False.
-                                        return False
-                                    elif direction == 'R':
-                                        if west == 'X':
-                                            # Move is safe to do. Perform.
-                                            current_board = copy.deepcopy(self.get_board().get_board_state())
-                                            current_board_row = current_board.get(coordinates[0]+1)                                   
-                                            # Step 1) If the right of coordinate is already empty, update accordingly
-                                            if east == 'X':
-                                                # Pop the marble to the east and insert 'X' at coordinate position
-                                                current_board_row.pop(coordinates[1]+1)
-                                                current_board_row.insert(coordinates[1], 'X')
-                                                # Update the board with the new board
-                                                counter = self.get_game_counter()
-                                                return self.validate_board(counter, player, current_board)                                             
-                                            # Step 2) Else, check how many values to the right of the coordinate are occupied by non-X
-                                            else:
-                                                empty_pos = None
-                                                # For loop to find the 1st occurrent of 'X' to the left of non-'X' values
-                                                for i in range(coordinates[1],len(current_board)):
-                                                    if current_board_row[i] == 'X':
-                                                        empty_pos = i
-                                                        break
-                                                    # If it doesn't reach this point, all values are occupied to the left.
-                                                    # We'd need to pop the index 0 value and insert 'X' at coordinate position
-                                                # Step 3a) Pop the value at the empty_pos and insert 'X' at coordinate position
-                                                if empty_pos:
-                                                    current_board_row.pop(empty_pos)
-                                                    current_board_row.insert(coordinates[1], 'X') 
-                                                    # Update the board with the new board
-                                                    counter = self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)                                          
-                                                # Step 3b) If all values are occupied to the right, pop left-most value and insert 'X' at coordinate position
-                                                else:
-                                                    popped_marble = current_board_row.pop(6)
-                                                    current_board_row.insert(coordinates[1], 'X')
-                                                    # If it's 'R', add to player count
-                                                    if popped_marble == 'R':
-                                                        self.add_captured(player)
-                                                    # If it's 'W' your own marble, return False (invalid)
-                                                    elif popped_marble == player.get_player_color():
-                                                        return False
-                                                    # If it's the opponent's marble, ignore (get_marble_count() will track the number on the board)
-
-                                                    # Update the board with the new board
-                                                    counter = self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)
-                                        # There's something blocking the move. Return False.
-                                        return False                            
-                                    elif direction == 'F':
-                                        if south == 'X':
-                                            # Move is safe to do. Perform.
-                                            current_board = copy.deepcopy(self.get_board().get_board_state())
-                                            current_board_column = list()           # This will be the values for the specific column from top to bottom
-                                            # Get all the values in the coordinate's column
-                                            for value in current_board.values():
-                                                current_board_column.append(value[coordinates[1]])
-
-                                            # Step 1) If the top of coordinate is already empty, update accordingly
-                                            if north == 'X':
-                                                # Pop the marble to the north and insert 'X' at coordinate position
-                                                current_board_column.pop(coordinates[0]-1)
-                                                current_board_column.insert(coordinates[0], 'X')
-                                                # Update the current_board with the updates column values
-                                                update_counter = 0
-                                                for value in current_board.values():
-                                                    value[coordinates[1]] = current_board_column[update_counter]
-                                                    update_counter += 1      
-
-                                                # Update the board with the new board
-                                                counter = self.get_game_counter()
-                                                return self.validate_board(counter, player, current_board)                                                  
-                                            # Step 2) Else, check how many values to the left of the coordinate are occupied by non-X
-                                            else:
-                                                empty_pos = None
-                                                # For loop to find the 1st occurrent of 'X' to the left of non-'X' values
-                                                for i in range(coordinates[0],-1,-1):
-                                                    if current_board_column[i] == 'X':
-                                                        empty_pos = i
-                                                        break
-                                                    # If it doesn't reach this point, all values are occupied to the left.
-                                                    # We'd need to pop the index 0 value and insert 'X' at coordinate position
-                                                # Step 3a) Pop the value at the empty_pos and insert 'X' at coordinate position
-                                                if empty_pos:
-                                                    current_board_column.pop(empty_pos)
-                                                    current_board_column.insert(coordinates[0], 'X')
-                                                    # Update the current_board with the updates column values
-                                                    update_counter = 0
-                                                    for value in current_board.values():
-                                                        value[coordinates[1]] = current_board_column[update_counter]
-                                                        update_counter += 1      
-                                                    # Update the board with the new board
-                                                    counter = self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)                                 
-                                                # Step 3b) If all values are occupied above, pop bottom value and insert 'X' at coordinate position
-                                                else:
-                                                    popped_marble = current_board_column.pop(0)
-                                                    current_board_column.insert(coordinates[0], 'X')
-                                                    # Update the current_board with the updates column values
-                                                    update_counter = 0
-                                                    for value in current_board.values():
-                                                        value[coordinates[1]] = current_board_column[update_counter]
-                                                        update_counter += 1  
-                                                    # If it's 'R', add to player count
-                                                    if popped_marble == 'R':
-                                                        self.add_captured(player)
-                                                    # If it's 'W' your own marble, return False (invalid)
-                                                    elif popped_marble == player.get_player_color():
-                                                        return False
-                                                    # If it's the opponent's marble, ignore (get_marble_count() will track the number on the board)
-
-                                                    # Update the board with the new board
-                                                    counter =  self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)
-                                        # There's something blocking the move. Return False.
-                                        return False
-                                    elif direction == 'B':
-                                        if north == 'X':
-                                            # Move is safe to do. Perform.
-                                            current_board = copy.deepcopy(self.get_board().get_board_state())
-                                            current_board_column = list()           # This will be the values for the specific column from top to bottom
-                                            # Get all the values in the coordinate's column
-                                            for value in current_board.values():
-                                                current_board_column.append(value[coordinates[1]])
-
-                                            # Step 1) If the bottom of coordinate is already empty, update accordingly
-                                            if south == 'X':
-                                                # Pop the marble to the north and insert 'X' at coordinate position
-                                                current_board_column.pop(coordinates[0]+1)
-                                                current_board_column.insert(coordinates[0], 'X')
-                                                # Update the current_board with the updates column values
-                                                update_counter = 0
-                                                for value in current_board.values():
-                                                    value[coordinates[1]] = current_board_column[update_counter]
-                                                    update_counter += 1      
-
-                                                # Update the board with the new board
-                                                counter = self.get_game_counter()
-                                                return self.validate_board(counter, player, current_board)                                                   
-                                            # Step 2) Else, check how many values to the left of the coordinate are occupied by non-X
-                                            else:
-                                                empty_pos = None
-                                                # For loop to find the 1st occurrent of 'X' to the left of non-'X' values
-                                                for i in range(coordinates[0],len(current_board)):
-                                                    if current_board_column[i] == 'X':
-                                                        empty_pos = i
-                                                        break    
-                                                    # If it doesn't reach this point, all values are occupied to the left.
-                                                    # We'd need to pop the index 0 value and insert 'X' at coordinate position
-                                                # Step 3a) Pop the value at the empty_pos and insert 'X' at coordinate position
-                                                if empty_pos:
-                                                    current_board_column.pop(empty_pos)
-                                                    current_board_column.insert(coordinates[0], 'X')
-                                                    # Update the current_board with the updates column values
-                                                    update_counter = 0
-                                                    for value in current_board.values():
-                                                        value[coordinates[1]] = current_board_column[update_counter]
-                                                        update_counter += 1      
-                                                    # Update the board with the new board
-                                                    counter = self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)
-                                                # Step 3b) If all values are occupied above, pop bottom value and insert 'X' at coordinate position
-                                                else:
-                                                    popped_marble = current_board_column.pop(6)
-                                                    current_board_column.insert(coordinates[0], 'X')
-                                                    # Update the current_board with the updates column values
-                                                    update_counter = 0
-                                                    for value in current_board.values():
-                                                        value[coordinates[1]] = current_board_column[update_counter]
-                                                        update_counter += 1  
-                                                    # If it's 'R', add to player count
-                                                    if popped_marble == 'R':
-                                                        self.add_captured(player)
-                                                    # If it's 'W' your own marble, return False (invalid)
-                                                    elif popped_marble == player.get_player_color():
-                                                        return False
-                                                    # If it's the opponent's marble, ignore (get_marble_count() will track the number on the board)
-
-                                                    # Update the board with the new board
-                                                    counter =  self.get_game_counter()
-                                                    return self.validate_board(counter, player, current_board)
-                                        # There's something blocking the move. Return False.
-                                        return False
-                                    # We shouldn't end up here since we've already checked the direction, but keeping return False just in case
-                                    return False
-                                return False
-                            return False
-                        return False
-                    return False
-                return False
-            return False
+        player = self.identify_player(player_name)
+        if not player:
+            return 'unknown player'
+        # Check 2) Check whether the game has been won or not
+        if self.get_winner() != None:
+            return 'game over'
+        # Check 3) Just in case, check whether the direction is correctly inputted
+        if direction not in ('L', 'R', 'F', 'B'):
+            return 'bad direction'
+        # Check 4) Check if it's the player's turn
+        if self.get_current_turn() != player and self.get_current_turn() != None:
+            return 'wrong turn'
+        # Checks 5-7) Check the coordinates are on the board and hold one of the player's marbles
+        if self.get_marble(coordinates) != player.get_player_color():
+            return 'not own marble'
+        # Check 8) Check if the move can be made (the cell the marble is pushed from is empty or off the board)
+        row_step, col_step = DIRECTIONS[direction]
+        if self.get_marble((coordinates[0] - row_step, coordinates[1] - col_step)) != 'X':
+            return 'blocked'
+        return None
+
+    def reject_move(self, reason, stage=None):
+        '''
+        Takes the reason a move is rejected (and the stage rejecting it, if that stage is
+        not marked as ended yet), records them on the instrumentation (if any) and returns False.
+        '''
+        if self._instrumentation != None:
+            if stage != None:
+                self._instrumentation.end_stage(stage)
+            self._instrumentation.reject(reason)
         return False
 
-    def validate_board(self, counter, player, current_board):
+    def get_instrumentation(self):
+        '''Returns the instrumentation object recording the moves (None if not instrumented)'''
+        return self._instrumentation
+
+    def add_observer(self, observer):
+        '''
+        Takes a callback to call with every move event of the game (a dict, see notify_move).
+        The callback is first called with a keyframe of the current state, so an observer
+        joining a game in progress starts in sync.
+        '''
+        self._observers += (observer,)
+        observer(self.get_keyframe())
+
+    def remove_observer(self, observer):
+        '''Stops calling the callback with move events'''
+        self._observers = tuple(other for other in self._observers if other != observer)
+
+    def set_keyframe_interval(self, interval):
+        '''Takes the # of move events between keyframes sent to the observers'''
+        self._keyframe_interval = interval
+
+    def get_keyframe(self):
+        '''
+        Returns the whole state of the game as a keyframe event: the sequence # of the last
+        move event it includes, the board size and rows (strings of 'W', 'B', 'R', 'X'), the
+        player to move, the red marbles captured by each player, the turn # and the winner.
+        '''
+        size = self.get_board().get_size()
+        board_state = self.get_board().get_board_state()
+        current_turn = self.get_current_turn()
+        return {'event': 'keyframe', 'seq': self._event_seq, 'size': size,
+                'board': [''.join(board_state[row + 1]) for row in range(size)],
+                'turn': current_turn.get_player_name() if current_turn else None,
+                'captured': {self.get_player1().get_player_name(): self._player1_count,
+                             self.get_player2().get_player_name(): self._player2_count},
+                'counter': self._game_turn_counter, 'winner': self.get_winner()}
+
+    def notify_move(self, player, old_board, popped_marble):
+        '''
+        Sends the observers the delta event of the move just made by the player, i.e.
+            {"event": "delta", "seq": 12, "player": "A", "cells": [[6, 4, "W"], [6, 6, "X"]],
+             "popped": "R", "captured": {"A": 3}, "turn": "B", "winner": null}
+        where cells are the [row, col, new marble] of the cells that changed (only the
+        pushed run), popped the marble pushed off ('X' if none), and captured only appears
+        if the player captured a red marble. Every keyframe interval, a keyframe event
+        with the same sequence # follows the delta.
+        '''
+        board = self.get_board()
+        size = board.get_size()
+        new_board = board.get_packed_state()
+        changed = (old_board[0] ^ new_board[0]) | (old_board[1] ^ new_board[1]) | (old_board[2] ^ new_board[2])
+        cells = []
+        while changed:
+            low_bit = changed & -changed
+            changed ^= low_bit
+            row, col = divmod(low_bit.bit_length() - 1, size)
+            cells.append([row, col, board.get_cell((row, col))])
+        self._event_seq += 1
+        event = {'event': 'delta', 'seq': self._event_seq, 'player': player.get_player_name(),
+                 'cells': cells, 'popped': popped_marble,
+                 'turn': self.get_current_turn().get_player_name(), 'winner': self.get_winner()}
+        if popped_marble == 'R':
+            event['captured'] = {player.get_player_name(): self.get_captured(player.get_player_name())}
+        self.notify_observers(event)
+        if self._event_seq % self._keyframe_interval == 0:
+            self.notify_observers(self.get_keyframe())
+
+    def notify_observers(self, event):
+        '''Calls every observer with the event'''
+        for observer in self._observers:
+            observer(event)
+
+    def set_instrumentation(self, instrumentation):
+        '''
+        Takes an instrumentation object (i.e. KubaInstrumentation, which may be shared by
+        many games) to record the stage timings and rejections of every move, or None to
+        stop recording.
+        '''
+        self._instrumentation = instrumentation
+
+    def resolve_push(self, player, current_board, current_hash, popped_marble):
+        '''
+        Takes the player, the packed board state (and its hash) after a push, and the
+        marble pushed off the board ('X' if none). Rejects the move if the player pushed
+        off their own marble, counts captured red marbles, and passes the board on to
+        validate_board.
+        '''
+        # If it's 'W' your own marble, return False (invalid)
+        if popped_marble == player.get_player_color():
+            return self.reject_move('own marble pushed off')
+        # If it's 'R', add to player count
+        if popped_marble == 'R':
+            self.add_captured(player)
+        # If it's the opponent's marble, ignore (get_marble_count() will track the number on the board)
+
+        # Update the board with the new board
+        counter = self.get_game_counter()
+        return self.validate_board(counter, player, current_board, current_hash, popped_marble)
+
+    def apply_move(self, player_name, coordinates, direction):
         '''
-        Takes the game turn # count, player, and current board state and validate 
-        whether the user's move. Pass the parameters to check_ko_rule and update board state accordingly.
+        Same as make_move, but if the move is valid an undo record is pushed onto the
+        undo stack so that undo_move can restore the game exactly as it was. Intended
+        for search code walking many positions on a single game. Returns True/False
+        like make_move.
+        '''
+        board = self.get_board()
+        counter = self.get_game_counter()
+        # Only the ko board of this turn's parity gets overwritten by the move
+        if counter % 2 == 0:
+            ko_board, ko_hash = self._even_turn_board, self._even_turn_hash
+        else:
+            ko_board, ko_hash = self._odd_turn_board, self._odd_turn_hash
+        undo_record = (board.get_packed_state(), board.get_hash(), board.get_marble_count(),
+                       ko_board, ko_hash, counter, self._current_turn,
+                       self._player1_count, self._player2_count, self._winner)
+        if not self.make_move(player_name, coordinates, direction):
+            return False
+        self._undo_stack.append(undo_record)
+        return True
+
+    def undo_move(self):
+        '''
+        Takes back the last move made through apply_move by restoring its undo record
+        (board, ko boards, turn counter, current turn, captured counts and winner).
+        Return False if there is no move to take back. Observers get a keyframe.
+        '''
+        if not self._undo_stack:
+            return False
+        (packed_state, board_hash, marble_count, ko_board, ko_hash, counter, current_turn,
+         player1_count, player2_count, winner) = self._undo_stack.pop()
+        if self._superko:
+            self.own_position_history()
+            self._position_history.discard(self.get_board().get_hash())
+        self.get_board().restore_state(packed_state, board_hash, marble_count)
+        if counter % 2 == 0:
+            self._even_turn_board, self._even_turn_hash = ko_board, ko_hash
+        else:
+            self._odd_turn_board, self._odd_turn_hash = ko_board, ko_hash
+        self._game_turn_counter = counter
+        self._current_turn = current_turn
+        self._player1_count = player1_count
+        self._player2_count = player2_count
+        self._winner = winner
+        if self._observers:
+            self._event_seq += 1
+            self.notify_observers(self.get_keyframe())
+        return True
+
+    def validate_board(self, counter, player, current_board, current_hash, popped_marble='X'):
+        '''
+        Takes the game turn # count, player, and current (packed) board state with its hash
+        (and the marble pushed off by the move, if any) and validate whether the user's move.
+        Pass the parameters to check_ko_rule and update board state accordingly.
         '''
         # If it is different, update the current board state officially and 
         # set the previous board as the current board for future reference
         if counter == 0:
-            self.get_board().set_board_state(current_board)
-            self.set_prev_board(counter)
-            self.inc_game_counter()
-            self.set_current_turn(player)
-            self.check_game_state()
+            self.accept_board(counter, player, current_board, current_hash, popped_marble)
             return True
         elif counter % 2 == 0: 
             # Get the previous board state (from 2 turns ago)
-            old_board = copy.deepcopy(self.get_even_board())  
+            old_board = self._even_turn_board
+            old_hash = self._even_turn_hash
             # Check if the ko rule applies (move reverts the previous move or not)
-            return self.check_ko_rule(counter, player, current_board, old_board)
+            return self.check_ko_rule(counter, player, current_board, current_hash, old_board, old_hash, popped_marble)
         elif counter % 2 == 1:
             # Get the previous board state (from 2 turns ago)
-            old_board = copy.deepcopy(self.get_odd_board())
+            old_board = self._odd_turn_board
+            old_hash = self._odd_turn_hash
             # Check if the ko rule applies (move reverts the previous move or not)
-            return self.check_ko_rule(counter, player, current_board, old_board)
+            return self.check_ko_rule(counter, player, current_board, current_hash, old_board, old_hash, popped_marble)
 
-    def check_ko_rule(self, counter, player, current_board, old_board):
+    def check_ko_rule(self, counter, player, current_board, current_hash, old_board, old_hash, popped_marble='X'):
         '''
         Compares current board vs board state from 2 turns ago to see if the move done 
         by player reverts to the old state or not (we should not go back-and-fourth 
         through same moves). Return True/False depending on result and update board accordingly.
+        The boards are compared by their hashes first; the packed boards are only
+        compared when the hashes match. With superko, any earlier position is rejected.
         '''
+        # Superko) the move may not recreate any position seen earlier in the game
+        if self._superko and current_hash in self._position_history:
+            return self.reject_move('ko rule', 'ko_check')
         # Check if the ko rule applies (move reverts the previous move or not)
-        if old_board != current_board:
-            self.get_board().set_board_state(current_board)
-            self.set_prev_board(counter)
-            self.inc_game_counter()
-            self.set_current_turn(player)
-            self.check_game_state()
+        if old_hash != current_hash or old_board != current_board:
+            if self._instrumentation != None:
+                self._instrumentation.end_stage('ko_check')
+            self.accept_board(counter, player, current_board, current_hash, popped_marble)
             return True
         # If it is the same, then that's not a valid move (by ko rule)
-        return False
+        return self.reject_move('ko rule', 'ko_check')
+
+    def accept_board(self, counter, player, current_board, current_hash, popped_marble='X'):
+        '''
+        Takes the game turn # count, player, and the validated (packed) board state with
+        its hash (and the marble pushed off by the move, if any). Updates the board
+        officially, stores it for the ko rule, and passes the turn to the next player.
+        '''
+        old_board = self.get_board().get_packed_state() if self._observers else None
+        self.get_board().apply_push(current_board, current_hash, popped_marble)
+        self.set_prev_board(counter)
+        self.inc_game_counter()
+        self.set_current_turn(player)
+        if self._instrumentation != None:
+            self._instrumentation.end_stage('update')
+        self.check_game_state()
+        if self._instrumentation != None:
+            self._instrumentation.end_stage('win_check')
+        if self._observers:
+            self.notify_move(player, old_board, popped_marble)
 
     def check_game_state(self):
         ''' 
         During make_move method, checks to see who is currently winning the game.
-        If the red marble count for one of the player is 7, update the winner.
+        If the red marble count for one of the player is 7 (the capture target), update the winner.
         Else if one of the player runs out of their marble, update the winner.
         '''
-        # Win scenario 1) if one of the players captured 7 red marbles, declare winner
-        if self.get_player1_count() >= 7:
+        # Win scenario 1) if one of the players captured 7 red marbles (the capture target), declare winner
+        if self.get_player1_count() >= self._capture_target:
             self.set_winner(self.get_player1())     
-        elif self.get_player2_count() >= 7:
+        elif self.get_player2_count() >= self._capture_target:
             self.set_winner(self.get_player2())   
 
         # Win scenario 2) if one of the player runs out of their corresponding marble color, declare winner
@@ -476,29 +762,179 @@ class KubaGame:
                 self.set_winner(self.get_player2())
             else:
                 self.set_winner(self.get_player1())
+
+        # Win scenario 3) if the player to move next has no legal moves, the player who just moved wins
+        if self._winner == None and self.get_current_turn() != None:
+            next_player = self.get_current_turn()
+            if next(self.iter_legal_moves(next_player.get_player_name()), None) == None:
+                if next_player == self.get_player1():
+                    self.set_winner(self.get_player2())
+                else:
+                    self.set_winner(self.get_player1())
         # If none of the above scenarios are applicable, continue on the game
 
+    def check_moves(self, player_name, moves):
+        '''
+        Takes the player name and a list of candidate (coordinates, direction) moves and
+        returns one result per move, in the same order, without changing the game. Each
+        result is a dict of:
+            legal       whether make_move would accept the move right now
+            reason      why make_move would reject it (one of REJECTION_REASONS), None if legal
+            popped      the marble the push sends off the board ('X' if none, None if the
+                        push is not made because of checks 1-8)
+            captured    the # of red marbles the player would have captured after the move
+        Everything that does not depend on the move (the player and turn checks, the board
+        bits and the ko rule boards) is looked up once for the whole batch.
+        '''
+        player = self.identify_player(player_name)
+        # Checks 1), 2) and 4) are the same for every move of the batch
+        if not player:
+            player_reason = 'unknown player'
+        elif self.get_winner() != None:
+            player_reason = 'game over'
+        else:
+            player_reason = None
+        turn_reason = None
+        if player and self.get_current_turn() != player and self.get_current_turn() != None:
+            turn_reason = 'wrong turn'
+        board = self.get_board()
+        size = board.get_size()
+        rays = board.get_rays()[0]
+        packed_state = board.get_packed_state()
+        occupied = packed_state[0] | packed_state[1] | packed_state[2]
+        color = player.get_player_color() if player else None
+        color_bits = packed_state[('W', 'B', 'R').index(color)] if player else 0
+        captured = self.get_captured(player_name)
+        # Board the ko rule compares against this turn (see validate_board), and the superko history
+        counter = self.get_game_counter()
+        if counter == 0:
+            ko_board, ko_hash = None, None
+        elif counter % 2 == 0:
+            ko_board, ko_hash = self._even_turn_board, self._even_turn_hash
+        else:
+            ko_board, ko_hash = self._odd_turn_board, self._odd_turn_hash
+        history = self._position_history if self._superko else ()
+
+        results = []
+        for coordinates, direction in moves:
+            result = {'legal': False, 'reason': None, 'popped': None, 'captured': captured}
+            results.append(result)
+            if player_reason != None:
+                result['reason'] = player_reason
+                continue
+            # Check 3) the direction, then check 4) the turn (same order as make_move)
+            if direction not in ('L', 'R', 'F', 'B'):
+                result['reason'] = 'bad direction'
+                continue
+            if turn_reason != None:
+                result['reason'] = turn_reason
+                continue
+            # Checks 5-7) the coordinates must be on the board and hold one of the player's marbles
+            row, col = coordinates
+            index = row * size + col
+            if not (0 <= row < size and 0 <= col < size) or not color_bits >> index & 1:
+                result['reason'] = 'not own marble'
+                continue
+            # Check 8) the cell the marble is pushed from must be empty or off the board
+            row_step, col_step = DIRECTIONS[direction]
+            behind = rays[-row_step, -col_step][index]
+            if len(behind) > 1 and occupied >> behind[1] & 1:
+                result['reason'] = 'blocked'
+                continue
+            current_board, current_hash, popped_marble = board.push_marbles((row, col), row_step, col_step)
+            result['popped'] = popped_marble
+            if popped_marble == color:
+                result['reason'] = 'own marble pushed off'
+            elif current_hash in history or (current_hash == ko_hash and current_board == ko_board):
+                result['reason'] = 'ko rule'
+            else:
+                result['legal'] = True
+                if popped_marble == 'R':
+                    result['captured'] = captured + 1
+        return results
+
+    def legal_moves(self, player_name, ko_rule=True):
+        '''
+        Takes the player name and returns a list of every (coordinates, direction) move
+        that make_move would accept for the player right now. Return an empty list if
+        the player is not in game, it is not their turn, or the game is over. If ko_rule
+        is False, moves that only the ko rule (or superko) forbids are listed as well.
+        '''
+        return list(self.iter_legal_moves(player_name, ko_rule))
+
+    def iter_legal_moves(self, player_name, ko_rule=True):
+        '''
+        Generator version of legal_moves. Each candidate push is computed on the packed
+        board (push_marbles does not change the board), so nothing is copied or undone.
+        '''
+        player = self.identify_player(player_name)
+        # Same as checks 1), 2) and 4) of make_move
+        if not player or self.get_winner() != None:
+            return
+        if self.get_current_turn() != player and self.get_current_turn() != None:
+            return
+        board = self.get_board()
+        size = board.get_size()
+        rays = board.get_rays()[0]
+        color = player.get_player_color()
+        counter = self.get_game_counter()
+        packed_state = board.get_packed_state()
+        occupied = packed_state[0] | packed_state[1] | packed_state[2]
+        color_bits = packed_state[('W', 'B', 'R').index(color)]
+        # Go through each of the player's marbles (checks 5-7) and each direction
+        while color_bits:
+            low_bit = color_bits & -color_bits
+            color_bits ^= low_bit
+            index = low_bit.bit_length() - 1
+            row, col = divmod(index, size)
+            for direction, (row_step, col_step) in DIRECTIONS.items():
+                # Check 8) the cell the marble is pushed from (2nd cell of the opposite ray) must be empty or off the board
+                behind = rays[-row_step, -col_step][index]
+                if len(behind) > 1 and occupied >> behind[1] & 1:
+                    continue
+                current_board, current_hash, popped_marble = board.push_marbles((row, col), row_step, col_step)
+                # Own marble may not be pushed off and the ko rule must allow the new board
+                if popped_marble == color:
+                    continue
+                if ko_rule and self.repeats_position(counter, current_board, current_hash):
+                    continue
+                yield (row, col), direction
+
+    def repeats_position(self, counter, current_board, current_hash):
+        '''
+        Takes the game turn # count and a (packed) board state with its hash. Returns
+        True if the board would be rejected by the ko rule (or superko) on this turn.
+        '''
+        if self._superko and current_hash in self._position_history:
+            return True
+        if counter == 0:
+            return False
+        elif counter % 2 == 0:
+            return self._even_turn_hash == current_hash and self._even_turn_board == current_board
+        return self._odd_turn_hash == current_hash and self._odd_turn_board == current_board
+
     def get_marble(self, coordinates):
         '''
         Takes the coordinates (tuple) of a cell and returns the marble (marble's color)
         that's at the specified coordinate.
         '''
-        # Check if row coordinate is in range(0,7)
-        if coordinates[0] in range(0,7):
-            if coordinates[1] in range(0,7):
-                return self.get_board().get_board_state().get(coordinates[0]+1)[coordinates[1]]
+        size = self.get_board().get_size()
+        # Check if row coordinate is in range(0,7) (0 to the board size)
+        if coordinates[0] in range(0,size):
+            if coordinates[1] in range(0,size):
+                return self.get_board().get_cell(coordinates)
             # If the row coordinate is in the range (0,7) BUT the col coordinate is either -1 or 7
             # Check if it's the top side or bottom side of the board (such as (0,-1), (6,7))
-            elif coordinates[1] == -1 or coordinates[1] == 7:
+            elif coordinates[1] == -1 or coordinates[1] == size:
                 return 'X'
             return False
         # If not, check to see if it's row coordinate is side of the board (used to check if move is valid)
-        elif coordinates[0] == -1 or coordinates[0] == 7:
+        elif coordinates[0] == -1 or coordinates[0] == size:
             # Check if col coordinate with x-coordinate hits the four corners of board (-1,-1), (-1,7), (7,-1) (7,7)
-            if coordinates[1] == -1 or coordinates[1] == 7:
+            if coordinates[1] == -1 or coordinates[1] == size:
                 return 'X'
             # Otherwise, check if it's the left side or right side of the board (such as (-1,0), (7,2), etc.)
-            elif coordinates[1] in range(0,7):
+            elif coordinates[1] in range(0,size):
                 return 'X'
             # If not, return False
             return False
@@ -509,24 +945,28 @@ class KubaGame:
         Returns the number of White marbles, Black marbles, and Red marbles
         as tuple in the order (W,B,R).
         '''
-        w_count = 0
-        b_count = 0
-        r_count = 0
-        # count each color from the board and add it to the list index
-        current_row = 1
-        while current_row < 8:
-            # fetch the marble color from current state of board and tally up
-            for marble in self.get_board().get_board_state().get(current_row):
-                if marble == 'W':
-                    w_count += 1
-                elif marble == 'B':
-                    b_count += 1
-                elif marble == 'R': 
-                    r_count += 1
-            current_row += 1
-    
-        marble_count = (w_count,b_count,r_count)
-        return marble_count
+        # The board keeps running counts (updated whenever a marble is pushed off)
+        return self.get_board().get_marble_count()
+
+class HibernatedKubaGame(KubaGame):
+    '''
+    Class of a KubaGame while it is hibernated (see KubaGame.hibernate). The first
+    access to the state of the game rehydrates it and turns it back into a KubaGame.
+    '''
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        '''Only called for attributes that are not set, i.e. the state dropped by hibernate'''
+        if name in HIBERNATED_SLOTS and self._hibernated != None:
+            self.rehydrate()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def __reduce_ex__(self, protocol):
+        '''Copying or pickling a hibernated game wakes it up first'''
+        self.rehydrate()
+        return self.__reduce_ex__(protocol)
 
 class KubaBoard:
     ''' 
@@ -534,51 +974,327 @@ class KubaBoard:
     corresponding class is initialized). Stores the current state of the board (marble
     colors) as well as getter/setter method to check and update the color of marble 
     from the user provided coordinate.
+
+    Internally the board is packed into three integers (one per marble color) where
+    bit (row * size + col) is set if that cell holds a marble of the color. Pushes and
+    board comparisons are done on these integers, so a move never copies the board.
+    get_board_state() still returns the familiar dict of rows for existing callers.
+
+    The board is 7x7 with the official setup unless another size (i.e. 9 or 11, see
+    get_default_setup) or a custom setup is given. A push only visits the marbles it
+    moves, so a move costs the same on a large board as on the official one.
     '''
 
-    def __init__(self):
+    __slots__ = ('_size', '_white', '_black', '_red', '_hash', '_white_count', '_black_count', '_red_count', '_debug')
+
+    def __init__(self, debug=False, size=None, setup=None):
         '''
-        Initializes a KubaBoard class instance without any input parameter by following
-        the Kuba board game initial setup as reference. This will be called by KubaGame
-        class when the corresponding class is initialized.
+        Initializes a KubaBoard class instance by following the Kuba board game initial
+        setup as reference. This will be called by KubaGame class when the corresponding
+        class is initialized. If debug is True, get_marble_count cross-checks the running
+        counts against a full scan of the board and raises RuntimeError if they drifted.
+
+        size is the # of rows and columns (7 by default, or the # of rows of the setup).
+        setup is an optional custom starting position, either a dict of rows like
+        get_board_state returns or a list of rows (strings or lists of 'W', 'B', 'R', 'X').
+        Raises ValueError if the setup is not a square board of the given size, or if the
+        size is not from 1 to 255 (to_bytes stores it in one byte).
         '''
-        # Board set according to official rules. Please don't change :/
-        self._board = {
-            1: ['W', 'W', 'X', 'X', 'X', 'B', 'B'],
-            2: ['W', 'W', 'X', 'R', 'X', 'B', 'B'],
-            3: ['X', 'X', 'R', 'R', 'R', 'X', 'X'],
-            4: ['X', 'R', 'R', 'R', 'R', 'R', 'X'],
-            5: ['X', 'X', 'R', 'R', 'R', 'X', 'X'],
-            6: ['B', 'B', 'X', 'R', 'X', 'W', 'W'],
-            7: ['B', 'B', 'X', 'X', 'X', 'W', 'W']
-        }
+        if size == None:
+            size = len(setup) if setup != None else 7
+        if not 1 <= size <= 255:
+            raise ValueError('The board size must be from 1 to 255, not %r' % (size,))
+        self._size = size
+        self._white = 0     # Bits of the cells holding 'W' marbles
+        self._black = 0     # Bits of the cells holding 'B' marbles
+        self._red = 0       # Bits of the cells holding 'R' marbles
+        self._hash = 0      # Zobrist hash of the board, updated on every push
+        self._white_count = 0   # Running count of 'W' marbles on the board
+        self._black_count = 0   # Running count of 'B' marbles on the board
+        self._red_count = 0     # Running count of 'R' marbles on the board
+        self._debug = debug
+        # Make sure the Zobrist keys and ray tables of the size exist (shared by every board of that size)
+        get_zobrist_tables(size)
+        get_ray_tables(size)
+        if setup != None:
+            self.set_board_state(KubaBoard.parse_setup(setup, size))
+        elif size != 7:
+            self.set_board_state(KubaBoard.parse_setup(get_default_setup(size), size))
+        else:
+            # Board set according to official rules. Please don't change :/
+            self.set_board_state({
+                1: ['W', 'W', 'X', 'X', 'X', 'B', 'B'],
+                2: ['W', 'W', 'X', 'R', 'X', 'B', 'B'],
+                3: ['X', 'X', 'R', 'R', 'R', 'X', 'X'],
+                4: ['X', 'R', 'R', 'R', 'R', 'R', 'X'],
+                5: ['X', 'X', 'R', 'R', 'R', 'X', 'X'],
+                6: ['B', 'B', 'X', 'R', 'X', 'W', 'W'],
+                7: ['B', 'B', 'X', 'X', 'X', 'W', 'W']
+            })
+
+    def fork(self):
+        '''Returns a copy of the board for KubaGame.fork (all of its attributes are integers)'''
+        return copy.copy(self)
+
+    def get_size(self):
+        '''Returns the # of rows (and columns) of the board'''
+        return self._size
+
+    def get_rays(self):
+        '''Returns the (rays, ray masks) tables of the board size (see build_ray_tables)'''
+        return RAY_TABLES[self._size]
 
     def get_board_state(self):
-        '''Returns the current state of the board'''
-        return self._board
+        '''
+        Returns the current state of the board as a dictionary of rows (1-7, or 1 to the
+        board size), each a list of marble colors. The dictionary is built fresh on every
+        call, so changing it does not change the board (use set_board_state for that).
+        '''
+        return KubaBoard.unpack_state(self.get_packed_state(), self._size)
 
     def set_board_state(self, board_state):
         '''
         Sets the board state to the given board dictionary. Intended to be used when
         the move is invalid (i.e. ko rule applied).
         '''
-        self._board = board_state
+        self.set_packed_state(KubaBoard.pack_state(board_state, self._size))
+
+    def get_packed_state(self):
+        '''Returns the current state of the board as a (white, black, red) tuple of bits'''
+        return (self._white, self._black, self._red)
+
+    def set_packed_state(self, packed_state, board_hash=None):
+        '''
+        Sets the board state to the given (white, black, red) tuple of bits. The hash of
+        the board can be passed in if already known (i.e. from push_marbles), otherwise
+        it is computed from the bits.
+        '''
+        self._white, self._black, self._red = packed_state
+        if board_hash is None:
+            board_hash = KubaBoard.hash_state(packed_state, self._size)
+        self._hash = board_hash
+        white, black, red = KubaBoard.count_state(packed_state)
+        self._white_count, self._black_count, self._red_count = white, black, red
+
+    def apply_push(self, packed_state, board_hash, popped_marble):
+        '''
+        Takes the packed board state and hash returned by push_marbles along with the
+        marble it pushed off ('X' if none) and sets it as the board state. Only the count
+        of the pushed off marble is updated, the board is not scanned.
+        '''
+        self._white, self._black, self._red = packed_state
+        self._hash = board_hash
+        if popped_marble == 'R':
+            self._red_count -= 1
+        elif popped_marble == 'W':
+            self._white_count -= 1
+        elif popped_marble == 'B':
+            self._black_count -= 1
+
+    def restore_state(self, packed_state, board_hash, marble_count):
+        '''
+        Takes a packed board state, its hash and its (W,B,R) marble count (as saved by
+        KubaGame.apply_move) and sets them back as the board state without rescanning.
+        '''
+        self._white, self._black, self._red = packed_state
+        self._hash = board_hash
+        self._white_count, self._black_count, self._red_count = marble_count
+
+    def is_debug(self):
+        '''Returns whether the board cross-checks its marble counts (debug mode)'''
+        return self._debug
+
+    def get_marble_count(self):
+        '''
+        Returns the number of White marbles, Black marbles, and Red marbles
+        as tuple in the order (W,B,R).
+        '''
+        marble_count = (self._white_count, self._black_count, self._red_count)
+        if self._debug and marble_count != KubaBoard.count_state(self.get_packed_state()):
+            raise RuntimeError('Marble count drifted: running %s, board %s'
+                               % (marble_count, KubaBoard.count_state(self.get_packed_state())))
+        return marble_count
+
+    def get_hash(self):
+        '''Returns the Zobrist hash of the current state of the board'''
+        return self._hash
+
+    def get_cell(self, coordinates):
+        '''
+        Takes the coordinates (tuple) of a cell on the board and returns the marble
+        color at that cell ('X' if empty). Coordinates are expected to be on the board.
+        '''
+        bit = 1 << (coordinates[0] * self._size + coordinates[1])
+        if self._white & bit:
+            return 'W'
+        elif self._black & bit:
+            return 'B'
+        elif self._red & bit:
+            return 'R'
+        return 'X'
+
+    def push_marbles(self, coordinates, row_step, col_step):
+        '''
+        Takes the coordinates (tuple) of the marble being pushed and the direction of
+        the push as a row/col step (e.g. (0,-1) pushes to the left). Returns a tuple of
+        the packed board state after the push, its hash, and the marble pushed off the
+        board ('X' if none). The board itself is not changed.
+
+        Every direction goes through the same code: the ray table of the cell lists the
+        cells in line up to the edge, so only the marbles of the pushed run are visited.
+        '''
+        size = self._size
+        rays, ray_masks = RAY_TABLES[size]
+        zobrist_keys = ZOBRIST_TABLES[size][0]
+        cell = coordinates[0] * size + coordinates[1]
+        ray = rays[row_step, col_step][cell]
+        white, black, red = self._white, self._black, self._red
+        new_hash = self._hash
+        run = 0                 # Length of the run of marbles in line from the pushed marble
+        # Collect the marbles in line until an empty cell or the edge of the board,
+        # moving each marble's key in the hash by one cell as we go
+        for index in ray:
+            bit = 1 << index
+            if white & bit:
+                marble = 'W'
+            elif black & bit:
+                marble = 'B'
+            elif red & bit:
+                marble = 'R'
+            else:
+                break
+            keys = zobrist_keys[marble]
+            new_hash ^= keys[index]
+            run += 1
+            if run < len(ray):
+                new_hash ^= keys[ray[run]]
+        popped_marble = 'X'
+        last_bit = 0
+        # If the run reached the edge, the last marble in line falls off the board
+        if run == len(ray):
+            popped_marble = marble
+            last_bit = 1 << ray[-1]
+            run -= 1
+        run_mask = ray_masks[row_step, col_step][cell][run]
+        clear_mask = ~(run_mask | last_bit)
+        shift = row_step * size + col_step
+        if shift > 0:
+            new_state = ((white & clear_mask) | (white & run_mask) << shift,
+                         (black & clear_mask) | (black & run_mask) << shift,
+                         (red & clear_mask) | (red & run_mask) << shift)
+        else:
+            new_state = ((white & clear_mask) | (white & run_mask) >> -shift,
+                         (black & clear_mask) | (black & run_mask) >> -shift,
+                         (red & clear_mask) | (red & run_mask) >> -shift)
+        return new_state, new_hash, popped_marble
+
+    @staticmethod
+    def parse_setup(setup, size):
+        '''
+        Takes a setup (a dict of rows 1 to size, or a list of rows, each a string or list of
+        'W', 'B', 'R' and 'X') and returns it as a board dictionary of rows. Raises ValueError
+        if it is not a board of size x size cells of those colors.
+        '''
+        rows = [setup[row + 1] for row in range(len(setup))] if isinstance(setup, dict) else list(setup)
+        if len(rows) != size or any(len(row) != size for row in rows):
+            raise ValueError('The setup is not a %dx%d board' % (size, size))
+        board_state = {}
+        for row, row_values in enumerate(rows):
+            row_values = list(row_values)
+            if any(marble not in ('W', 'B', 'R', 'X') for marble in row_values):
+                raise ValueError('Row %d of the setup has a marble other than W, B, R or X' % (row + 1))
+            board_state[row + 1] = row_values
+        return board_state
+
+    @staticmethod
+    def pack_state(board_state, size=7):
+        '''Takes a board dictionary of rows (1 to size) and returns it as a (white, black, red) tuple of bits'''
+        white = black = red = 0
+        for row in range(0, size):
+            for col, marble in enumerate(board_state[row + 1]):
+                bit = 1 << (row * size + col)
+                if marble == 'W':
+                    white |= bit
+                elif marble == 'B':
+                    black |= bit
+                elif marble == 'R':
+                    red |= bit
+        return (white, black, red)
+
+    @staticmethod
+    def count_state(packed_state):
+        '''Takes a (white, black, red) tuple of bits and returns the (W,B,R) count of marbles by a full scan'''
+        return tuple(bin(color_bits).count('1') for color_bits in packed_state)
+
+    @staticmethod
+    def hash_state(packed_state, size=7):
+        '''Takes a (white, black, red) tuple of bits (and the board size) and returns the Zobrist hash of that board'''
+        board_hash = 0
+        zobrist_keys = get_zobrist_tables(size)[0]
+        for color, color_bits in zip(('W', 'B', 'R'), packed_state):
+            keys = zobrist_keys[color]
+            while color_bits:
+                low_bit = color_bits & -color_bits
+                board_hash ^= keys[low_bit.bit_length() - 1]
+                color_bits ^= low_bit
+        return board_hash
+
+    @staticmethod
+    def unpack_state(packed_state, size=7):
+        '''Takes a (white, black, red) tuple of bits and returns it as a board dictionary of rows (1 to size)'''
+        white, black, red = packed_state
+        board_state = {}
+        for row in range(0, size):
+            row_values = []
+            for col in range(0, size):
+                bit = 1 << (row * size + col)
+                if white & bit:
+                    row_values.append('W')
+                elif black & bit:
+                    row_values.append('B')
+                elif red & bit:
+                    row_values.append('R')
+                else:
+                    row_values.append('X')
+            board_state[row + 1] = row_values
+        return board_state
 
 class KubaPlayer:
     ''' 
     Player represents the player that is specifically playing the Kuba board game.
     Class instance is initialized with player name and marble color of choice (should
     be either B or W).
+
+    Players never change, so games get them through KubaPlayer.intern and every game
+    between the same players shares the same two records.
     '''
-    
+
+    __slots__ = ('_name', '_color', '__weakref__')
+
     def __init__(self, player_data):
         '''
         Initializes a KubaPlayer class instance by taking player_data (tuple with
-        player name and marble color) and set it accordingly for the instance.
+        player name and marble color) and set it accordingly for the instance. Raises
+        ValueError if the color is not 'W' or 'B'.
         '''
+        if player_data[1] not in ('W', 'B'):
+            raise ValueError('The marble color of a player must be W or B, not %r' % (player_data[1],))
         self._name = player_data[0]
         self._color = player_data[1]
-    
+
+    @staticmethod
+    def intern(player_data):
+        '''
+        Takes player_data (tuple with player name and marble color) and returns the
+        KubaPlayer of that name and color, shared by every game still holding it.
+        '''
+        player_data = (player_data[0], player_data[1])
+        player = PLAYER_RECORDS.get(player_data)
+        if player == None:
+            player = KubaPlayer(player_data)
+            PLAYER_RECORDS[player_data] = player
+        return player
+
     def get_player_name(self):
         '''Returns the name of the player'''
         return self._name
@@ -587,6 +1303,136 @@ class KubaPlayer:
         '''Returns the marble color corresponding to the player'''
         return self._color
 
+def random_policy(game, player_name, moves, rng):
+    '''Move policy that picks one of the moves at random'''
+    return rng.choice(moves)
+
+def greedy_capture_policy(game, player_name, moves, rng):
+    '''
+    Move policy that pushes off a red marble if it can, else an opponent's marble,
+    else picks one of the moves at random.
+    '''
+    board = game.get_board()
+    color = game.identify_player(player_name).get_player_color()
+    best_moves = []
+    best_value = 0
+    for coordinates, direction in moves:
+        popped_marble = board.push_marbles(coordinates, *DIRECTIONS[direction])[2]
+        value = 2 if popped_marble == 'R' else 1 if popped_marble not in ('X', color) else 0
+        if value > best_value:
+            best_moves, best_value = [], value
+        if value == best_value:
+            best_moves.append((coordinates, direction))
+    return rng.choice(best_moves)
+
+def engine_policy(game, player_name, moves, rng, depth=2):
+    '''Move policy that plays the move picked by KubaEngine searching to the given depth'''
+    from KubaEngine import KubaEngine
+    move = KubaEngine(max_depth=depth).search(game, player_name)['move']
+    return move if move in moves else rng.choice(moves)
+
+# Move policies available to the tournament, by name ('engine:N' searches N turns deep)
+POLICIES = {'random': random_policy, 'greedy': greedy_capture_policy, 'engine': engine_policy}
+
+def get_policy(policy_name):
+    '''Takes a policy name (i.e. 'random', 'greedy', 'engine' or 'engine:3') and returns the policy function'''
+    name, _, depth = policy_name.partition(':')
+    if name not in POLICIES:
+        raise ValueError('Unknown policy %r (choose from %s)' % (policy_name, ', '.join(POLICIES)))
+    if depth:
+        return lambda game, player_name, moves, rng: POLICIES[name](game, player_name, moves, rng, int(depth))
+    return POLICIES[name]
+
+def play_game(game_setup):
+    '''
+    Takes a (policy1, policy2, seed, game index, max turns) tuple and plays one game between
+    the two policies. The policies take turns being the first to move (and playing 'W').
+    Every move a policy picks that make_move rejects because of the ko rule is counted
+    and the policy picks again. Returns a dictionary with the result of the game.
+    If the tuple has a 6th item set to True, the result also has the "players" and the
+    accepted "moves" of the game as a game record (see KubaReplay.replay_record).
+    '''
+    policy1, policy2, seed, index, max_turns = game_setup[:5]
+    record_moves = len(game_setup) > 5 and game_setup[5]
+    moves_played = []
+    rng = random.Random('%s-%s' % (seed, index))
+    if index % 2 == 0:
+        game = KubaGame(('policy1', 'W'), ('policy2', 'B'))
+        player_name = 'policy1'
+    else:
+        game = KubaGame(('policy2', 'W'), ('policy1', 'B'))
+        player_name = 'policy2'
+    policies = {'policy1': get_policy(policy1), 'policy2': get_policy(policy2)}
+    ko_rejections = {'policy1': 0, 'policy2': 0}
+    while game.get_winner() == None and game.get_game_counter() < max_turns:
+        # Policies pick from every move the ko rule aside would allow
+        moves = game.legal_moves(player_name, ko_rule=False)
+        if not moves:
+            break
+        while moves:
+            move = policies[player_name](game, player_name, moves, rng)
+            if game.make_move(player_name, move[0], move[1]):
+                if record_moves:
+                    moves_played.append([player_name, list(move[0]), move[1]])
+                break
+            ko_rejections[player_name] += 1
+            moves.remove(move)
+        if not moves:
+            break
+        player_name = game.get_current_turn().get_player_name()
+    result = {
+        'winner': game.get_winner(),
+        'turns': game.get_game_counter(),
+        'captured': {'policy1': game.get_captured('policy1'), 'policy2': game.get_captured('policy2')},
+        'ko_rejections': ko_rejections,
+    }
+    if record_moves:
+        result['players'] = [[player.get_player_name(), player.get_player_color()]
+                             for player in (game.get_player1(), game.get_player2())]
+        result['moves'] = moves_played
+    return result
+
+def tournament(policy1, policy2, games=100, seed=0, processes=None, max_turns=1000):
+    '''
+    Plays the given # of games between two move policies (names from POLICIES) over a
+    process pool and returns aggregated statistics: win rates, game lengths, red marbles
+    captured and ko rejections of each policy. Games that reach max_turns without a
+    winner count as draws. The results only depend on the seed, not on the # of processes.
+    '''
+    from multiprocessing import Pool
+    get_policy(policy1)
+    get_policy(policy2)
+    game_setups = [(policy1, policy2, seed, index, max_turns) for index in range(games)]
+    with Pool(processes) as pool:
+        results = pool.map(play_game, game_setups, chunksize=max(1, games // 64))
+    turns = [result['turns'] for result in results]
+    stats = {'games': games, 'policy1': policy1, 'policy2': policy2, 'seed': seed,
+             'draws': sum(1 for result in results if result['winner'] == None),
+             'turns': {'mean': sum(turns) / games if games else 0.0,
+                       'min': min(turns, default=0), 'max': max(turns, default=0)}}
+    for side in ('policy1', 'policy2'):
+        wins = sum(1 for result in results if result['winner'] == side)
+        stats[side + '_wins'] = wins
+        stats[side + '_win_rate'] = wins / games if games else 0.0
+        stats[side + '_captured'] = sum(result['captured'][side] for result in results)
+        stats[side + '_ko_rejections'] = sum(result['ko_rejections'][side] for result in results)
+    return stats
+
+def tournament_main(argv):
+    '''Runs a tournament from the command line and prints the statistics as JSON'''
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(prog='KubaGame.py tournament', description='Self-play tournament between two move policies')
+    parser.add_argument('policy1', help='random, greedy, engine or engine:DEPTH')
+    parser.add_argument('policy2', help='random, greedy, engine or engine:DEPTH')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--max-turns', type=int, default=1000)
+    args = parser.parse_args(argv)
+    stats = tournament(args.policy1, args.policy2, args.games, args.seed, args.processes, args.max_turns)
+    print(json.dumps(stats, indent=2))
+
 def main():
     '''Runs if the file is run as script. '''
     game = KubaGame(('PlayerA', 'W'), ('PlayerB', 'B'))
@@ -660,4 +1506,8 @@ def main():
  
 if __name__ == '__main__':
     # Determines whether the main function is called 
-    main()
+    # (or the tournament, i.e. "python KubaGame.py tournament random greedy --games 1000")
+    if sys.argv[1:2] == ['tournament']:
+        tournament_main(sys.argv[2:])
+    else:
+        main()
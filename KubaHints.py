@@ -0,0 +1,129 @@
+import threading    # Import to search in the background
+import time         # Import to wait for a hint with a timeout
+
+from KubaEngine import KubaEngine
+
+class KubaHints:
+    '''
+    KubaHints suggests a move for the player to move in a live KubaGame. A worker thread
+    searches the current position with KubaEngine by iterative deepening, and every
+    completed depth replaces the hint, so get_hint() answers at once with the best move
+    found so far and the answer keeps improving while nobody moves.
+
+    KubaHints observes the game (KubaGame.add_observer): as soon as make_move (or
+    undo_move) changes the position, the search of the old position is stopped and the
+    new one is searched on a fork of the game, so the live game is never touched by the
+    worker. The engine keeps its transposition table and move ordering from one
+    position to the next, so the work done on earlier positions speeds up the next.
+
+    The worker is a thread, so it shares the interpreter with the caller: the caller's
+    calls are not blocked, but are interleaved with the search.
+    '''
+
+    def __init__(self, game, engine=None, player_name=None, max_depth=32):
+        '''
+        Takes the game to give hints for, the engine searching it (a KubaEngine without
+        a time limit searching up to max_depth by default) and the player to move if
+        no-one has made a move yet (player1 by default). Starts searching right away.
+        '''
+        self._game = game
+        self._engine = engine if engine != None else KubaEngine(max_depth=max_depth)
+        self._first_player = player_name if player_name != None else game.get_player1().get_player_name()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)     # Notified when the position or the hint changes
+        self._generation = 0        # Bumped on every change of the position
+        self._position = None       # (generation, fork of the game, player to move) not searched yet
+        self._last_seq = None       # Sequence # of the last move event seen
+        self._hint = None           # (generation, search result) of the deepest completed search
+        self._searched = None       # Generation whose search is over (searched to max depth, a forced win, or game over)
+        self._closed = False
+        self._thread = threading.Thread(target=self.search_loop, daemon=True)
+        self._thread.start()
+        game.add_observer(self.on_event)
+
+    def on_event(self, event):
+        '''Observer of the game: hands the new position to the worker and stops the old search'''
+        if event['seq'] == self._last_seq:
+            return      # The keyframe following a delta, same position
+        self._last_seq = event['seq']
+        game = self._game.fork()
+        current_turn = game.get_current_turn()
+        player_name = current_turn.get_player_name() if current_turn != None else self._first_player
+        with self._lock:
+            self._generation += 1
+            self._position = (self._generation, game, player_name)
+            self._changed.notify_all()
+
+    def search_loop(self):
+        '''Worker thread: searches each new position until it is searched out or changes'''
+        while True:
+            with self._lock:
+                while self._position == None and not self._closed:
+                    self._changed.wait()
+                if self._closed:
+                    return
+                generation, game, player_name = self._position
+                self._position = None
+            if game.get_winner() == None:
+                self.search_position(generation, game, player_name)
+            with self._lock:
+                self._searched = generation
+                self._changed.notify_all()
+
+    def search_position(self, generation, game, player_name):
+        '''Searches one position, publishing the result of every completed depth until the position changes'''
+
+        def should_stop():
+            return self._generation != generation or self._closed
+
+        def on_iteration(result):
+            result['player'] = player_name
+            with self._lock:
+                if self._generation == generation:
+                    self._hint = (generation, result)
+                    self._changed.notify_all()
+
+        self._engine.search(game, player_name, on_iteration, should_stop)
+
+    def get_hint(self):
+        '''
+        Returns the best move found so far for the current position, as the search result
+        of the deepest completed depth (see KubaEngine.search, plus the "player" to move).
+        Return None if no depth has been completed yet or the game is over.
+        '''
+        hint = self._hint
+        if hint == None or hint[0] != self._generation:
+            return None
+        return hint[1]
+
+    def wait_hint(self, depth=1, timeout=None):
+        '''
+        Waits until the current position has been searched to the given depth (or the
+        search of it is over) and returns get_hint(). Return None on timeout.
+        '''
+        deadline = time.monotonic() + timeout if timeout != None else None
+        with self._lock:
+            while True:
+                hint = self._hint
+                if hint != None and hint[0] == self._generation and hint[1]['depth'] >= depth:
+                    return hint[1]
+                if self._searched == self._generation:
+                    return self.get_hint()
+                remaining = deadline - time.monotonic() if deadline != None else None
+                if remaining != None and remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def close(self):
+        '''Stops observing the game and stops the worker thread'''
+        self._game.remove_observer(self.on_event)
+        with self._lock:
+            self._closed = True
+            self._changed.notify_all()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,86 @@
+import time     # Import for the stage timers
+
+# Stages of KubaGame.make_move, in order. A rejected move stops at the stage that rejected it
+STAGES = ('checks', 'push', 'ko_check', 'update', 'win_check')
+
+class KubaInstrumentation:
+    '''
+    KubaInstrumentation records where make_move spends its time and why moves get
+    rejected, for every game it is set on (KubaGame.set_instrumentation; one instance
+    can be shared by many games). A move goes through the stages of STAGES:
+
+        checks      checks 1-8 (player, game over, direction, turn, marble, blocked)
+        push        computing the board after the push
+        ko_check    the ko rule (and superko) check
+        update      storing the new board, ko board and turn
+        win_check   the win scenarios, including whether the next player can move
+
+    Rejected moves are counted by their reason (KubaGame.REJECTION_REASONS). The totals
+    are read with get_snapshot(). If a callback is given, it is called after every move
+    with a dict of the move, whether it was accepted, the rejection reason and the
+    seconds spent in each stage it went through.
+
+    Games without instrumentation only check one attribute per stage.
+    '''
+
+    def __init__(self, callback=None, clock=time.perf_counter):
+        '''Takes the optional per-move callback and the clock used for the timings (seconds)'''
+        self._callback = callback
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        '''Sets every counter and timing back to zero'''
+        self._moves = 0
+        self._accepted = 0
+        self._rejections = {}
+        self._stage_time = {stage: 0.0 for stage in STAGES}
+        self._stage_calls = {stage: 0 for stage in STAGES}
+        self._move_stages = {}      # Seconds per stage of the current move (callback only)
+        self._reason = None         # Rejection reason of the current move
+        self._last = 0.0            # Clock at the end of the last stage
+
+    def start_move(self):
+        '''Called by make_move when a move starts'''
+        self._moves += 1
+        self._reason = None
+        if self._callback != None:
+            self._move_stages = {}
+        self._last = self._clock()
+
+    def end_stage(self, stage):
+        '''Called by make_move at the end of each stage; adds the time since the previous stage'''
+        now = self._clock()
+        elapsed = now - self._last
+        self._stage_time[stage] += elapsed
+        self._stage_calls[stage] += 1
+        if self._callback != None:
+            self._move_stages[stage] = elapsed
+        self._last = now
+
+    def reject(self, reason):
+        '''Called by make_move with the reason the move is rejected'''
+        self._rejections[reason] = self._rejections.get(reason, 0) + 1
+        self._reason = reason
+
+    def end_move(self, player_name, coordinates, direction, accepted):
+        '''Called by make_move with the move once it is accepted or rejected'''
+        if accepted:
+            self._accepted += 1
+        if self._callback != None:
+            self._callback({'player': player_name, 'coordinates': coordinates, 'direction': direction,
+                            'accepted': accepted, 'reason': self._reason, 'stages': self._move_stages})
+
+    def get_snapshot(self):
+        '''
+        Returns the totals so far as a dict: # of moves, accepted and rejected moves,
+        rejections by reason, and for each stage the # of moves that reached its end,
+        the total seconds and the mean nanoseconds spent in it.
+        '''
+        stages = {}
+        for stage in STAGES:
+            calls = self._stage_calls[stage]
+            total = self._stage_time[stage]
+            stages[stage] = {'calls': calls, 'total_s': total, 'mean_ns': 1e9 * total / calls if calls else 0.0}
+        return {'moves': self._moves, 'accepted': self._accepted, 'rejected': self._moves - self._accepted,
+                'rejections': dict(self._rejections), 'stages': stages}
@@ -0,0 +1,257 @@
+import os       # Import for fsync and atomic renames of the journal files
+import struct   # Import to pack the journal records
+import threading    # Import to fsync the journal in the background
+import zlib     # Import for the record checksums
+
+from KubaGame import KubaGame
+
+# Every journal record is: payload length (u32), CRC-32 of the payload (u32), payload.
+# The payload starts with the record type and the game ID (u16 length + UTF-8):
+#   b'C' + game bytes (KubaGame.to_bytes)       a game is registered
+#   b'M' + player name (u16 length + UTF-8), row, col (u8), direction (1 byte)
+#   b'E'                                        a game is removed
+# The snapshot file holds the journal generation (u64) followed by one b'C' record per game.
+RECORD_HEADER = struct.Struct('<II')
+SNAPSHOT_FILE = 'snapshot.bin'
+
+def pack_text(text):
+    '''Packs a string as u16 length + UTF-8'''
+    encoded = text.encode('utf-8')
+    return struct.pack('<H', len(encoded)) + encoded
+
+def unpack_text(data, offset):
+    '''Returns the string packed by pack_text at the offset and the offset after it'''
+    length = struct.unpack_from('<H', data, offset)[0]
+    return bytes(data[offset + 2:offset + 2 + length]).decode('utf-8'), offset + 2 + length
+
+def pack_record(payload):
+    '''Frames a payload with its length and checksum'''
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def read_records(data):
+    '''
+    Yields the payloads of the framed records in data, stopping at the first record that
+    is cut short or fails its checksum (i.e. the tail of a write interrupted by a crash).
+    '''
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            return
+        yield payload
+        offset += RECORD_HEADER.size + length
+
+def apply_record(games, payload):
+    '''Applies one journal record to the dictionary of games by game ID'''
+    kind = payload[:1]
+    game_id, offset = unpack_text(payload, 1)
+    if kind == b'C':
+        games[game_id] = KubaGame.from_bytes(payload[offset:])
+    elif kind == b'M' and game_id in games:
+        player_name, offset = unpack_text(payload, offset)
+        row, col = payload[offset], payload[offset + 1]
+        games[game_id].make_move(player_name, (row, col), chr(payload[offset + 2]))
+    elif kind == b'E':
+        games.pop(game_id, None)
+
+class KubaJournal:
+    '''
+    KubaJournal makes a set of in-flight games crash-safe. Registered games and every
+    accepted move are appended to a journal file, and the full state of every game is
+    periodically written to a compact snapshot (KubaGame.to_bytes), after which a new,
+    empty journal is started. KubaJournal.restore loads the latest snapshot and replays
+    only the journal written since.
+
+    Appends only add the record to an in-memory buffer. A background thread writes the
+    buffer and fsyncs it every sync_interval seconds (group fsync), so a move costs no
+    disk I/O on the caller's side; call flush() to make everything so far durable now.
+    The buffer lock is only held to swap the buffer out, never across the write and
+    fsync, so moves are not held up by a group fsync in progress.
+    '''
+
+    def __init__(self, directory, snapshot_interval=10000, sync_interval=0.01):
+        '''
+        Takes the directory of the journal (created if needed), the # of moves between
+        snapshots, and the max time (seconds) between group fsyncs. Games restored from
+        an existing journal in the directory are available from get_games().
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._snapshot_interval = snapshot_interval
+        self._sync_interval = sync_interval
+        self._games, self._generation = KubaJournal.load(directory)
+        self._lock = threading.Lock()       # Guards the buffer, and the games while a snapshot is taken
+        self._file_lock = threading.Lock()  # Guards the journal file (one flush or checkpoint at a time)
+        self._buffer = []                   # Records not written to the journal file yet
+        self._moves_since_snapshot = 0
+        self._file = open(self.journal_path(self._generation), 'ab')
+        # Start from a fresh snapshot, so nothing gets appended after a torn record left by a crash
+        self.checkpoint()
+        self._closed = threading.Event()
+        self._sync_thread = threading.Thread(target=self.sync_loop, daemon=True)
+        self._sync_thread.start()
+
+    def get_games(self):
+        '''Returns the dictionary of journaled games by game ID'''
+        return self._games
+
+    def journal_path(self, generation):
+        '''Returns the path of the journal file of the given generation'''
+        return os.path.join(self._directory, 'journal-%d.log' % generation)
+
+    def register(self, game_id, game):
+        '''Takes a game ID and a game (new or in progress) and starts journaling it'''
+        record = pack_record(b'C' + pack_text(game_id) + game.to_bytes())
+        with self._lock:
+            self._games[game_id] = game
+            self._buffer.append(record)
+
+    def remove(self, game_id):
+        '''Stops journaling a game (i.e. once it is over)'''
+        record = pack_record(b'E' + pack_text(game_id))
+        with self._lock:
+            if self._games.pop(game_id, None) != None:
+                self._buffer.append(record)
+
+    def make_move(self, game_id, player_name, coordinates, direction):
+        '''Makes the move on the journaled game and records it if it was accepted. Returns the make_move result'''
+        record = pack_record(KubaJournal.move_payload(game_id, player_name, coordinates, direction))
+        # Make the move and buffer its record at once, so a snapshot has either both or neither
+        with self._lock:
+            if not self._games[game_id].make_move(player_name, coordinates, direction):
+                return False
+            self._buffer.append(record)
+        self.count_move()
+        return True
+
+    def record_move(self, game_id, player_name, coordinates, direction):
+        '''
+        Records a move already accepted by the game's make_move. A checkpoint taken between
+        the move and its record would replay it twice, so games whose moves are recorded
+        this way must not be moved while another thread can checkpoint (use make_move).
+        '''
+        self.append(KubaJournal.move_payload(game_id, player_name, coordinates, direction))
+        self.count_move()
+
+    @staticmethod
+    def move_payload(game_id, player_name, coordinates, direction):
+        '''Returns the payload of the journal record of a move'''
+        return (b'M' + pack_text(game_id) + pack_text(player_name)
+                + bytes([coordinates[0], coordinates[1]]) + direction.encode('ascii'))
+
+    def count_move(self):
+        '''Counts a recorded move, taking a snapshot every snapshot_interval moves'''
+        self._moves_since_snapshot += 1
+        if self._moves_since_snapshot >= self._snapshot_interval:
+            self.checkpoint()
+
+    def append(self, payload):
+        '''Adds a record to the buffer written out by the next group fsync'''
+        record = pack_record(payload)
+        with self._lock:
+            self._buffer.append(record)
+
+    def flush(self):
+        '''Writes the buffered records to the journal and fsyncs it'''
+        with self._file_lock:
+            # Only swapping the buffer out holds up appends, not the write and the fsync
+            with self._lock:
+                records = self._buffer
+                self._buffer = []
+            if records:
+                self._file.write(b''.join(records))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def sync_loop(self):
+        '''Group fsync: flushes the buffer every sync_interval seconds until closed'''
+        while not self._closed.wait(self._sync_interval):
+            self.flush()
+
+    def checkpoint(self):
+        '''
+        Writes a snapshot of every game and starts a new, empty journal. The snapshot is
+        written to a temporary file and renamed into place, so a crash at any point
+        leaves either the old snapshot and journal or the new ones.
+        '''
+        with self._file_lock:
+            # Take the snapshot and the records buffered so far at once: every record
+            # appended before is in the snapshot and goes to the old journal, every record
+            # appended after goes to the new journal
+            with self._lock:
+                records = self._buffer
+                self._buffer = []
+                self._moves_since_snapshot = 0
+                generation = self._generation + 1
+                snapshot = [struct.pack('<Q', generation)]
+                for game_id, game in self._games.items():
+                    snapshot.append(pack_record(b'C' + pack_text(game_id) + game.to_bytes()))
+            if records:
+                self._file.write(b''.join(records))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            snapshot_path = os.path.join(self._directory, SNAPSHOT_FILE)
+            with open(snapshot_path + '.tmp', 'wb') as snapshot_file:
+                snapshot_file.write(b''.join(snapshot))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(snapshot_path + '.tmp', snapshot_path)
+            KubaJournal.sync_directory(self._directory)
+            self._file.close()
+            old_path = self.journal_path(self._generation)
+            self._generation = generation
+            self._file = open(self.journal_path(generation), 'ab')
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def close(self):
+        '''Stops the background fsync, flushes what is left and closes the journal'''
+        self._closed.set()
+        self._sync_thread.join()
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def sync_directory(directory):
+        '''Fsyncs a directory so a rename in it is durable (not available on Windows)'''
+        if hasattr(os, 'O_DIRECTORY'):
+            descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+
+    @staticmethod
+    def load(directory):
+        '''
+        Returns the games saved in a journal directory (by game ID) and the current
+        journal generation: the latest snapshot plus the journal written since it.
+        '''
+        games = {}
+        generation = 0
+        snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'rb') as snapshot_file:
+                data = snapshot_file.read()
+            generation = struct.unpack_from('<Q', data, 0)[0]
+            for payload in read_records(memoryview(data)[8:]):
+                apply_record(games, bytes(payload))
+        journal_path = os.path.join(directory, 'journal-%d.log' % generation)
+        if os.path.exists(journal_path):
+            with open(journal_path, 'rb') as journal_file:
+                data = journal_file.read()
+            for payload in read_records(data):
+                apply_record(games, payload)
+        return games, generation
+
+    @staticmethod
+    def restore(directory):
+        '''Returns the games (by game ID) saved in a journal directory'''
+        return KubaJournal.load(directory)[0]
@@ -0,0 +1,165 @@
+import json     # Import to store and read the reference counts
+import sys      # Import to parse the command line
+import time     # Import to measure positions per second
+
+from KubaGame import KubaGame
+
+# Kinds of moves counted at each ply
+COUNTS = ('nodes', 'captures', 'push_offs', 'ko_rejections', 'wins')
+
+# Reference counts of the initial setup with PlayerA (W) moving first, per ply (ply 1 first)
+REFERENCE_COUNTS = [
+    {'nodes': 8, 'captures': 0, 'push_offs': 0, 'ko_rejections': 0, 'wins': 0},
+    {'nodes': 64, 'captures': 0, 'push_offs': 0, 'ko_rejections': 0, 'wins': 0},
+    {'nodes': 640, 'captures': 0, 'push_offs': 0, 'ko_rejections': 0, 'wins': 0},
+    {'nodes': 6384, 'captures': 0, 'push_offs': 16, 'ko_rejections': 8, 'wins': 0},
+    {'nodes': 70812, 'captures': 0, 'push_offs': 624, 'ko_rejections': 148, 'wins': 0},
+    {'nodes': 782832, 'captures': 0, 'push_offs': 9380, 'ko_rejections': 2300, 'wins': 0},
+]
+
+def new_counts(depth):
+    '''Returns a list of zeroed counts for each ply up to the depth'''
+    return [dict.fromkeys(COUNTS, 0) for _ in range(depth)]
+
+def add_counts(total, counts):
+    '''Adds the per-ply counts to the total (in place) and returns the total'''
+    for total_ply, ply_counts in zip(total, counts):
+        for kind in COUNTS:
+            total_ply[kind] += ply_counts[kind]
+    return total
+
+def perft(game, depth, player_name=None, counts=None, ply=0):
+    '''
+    Takes a game, a depth and the player to move (the current turn by default, or player1
+    if no-one has made a move yet), and counts every sequence of legal moves up to the
+    depth, by playing each one on the game with apply_move and taking it back with
+    undo_move. Returns a list with the counts of each ply (ply 1 first):
+        nodes           # of moves accepted by make_move, i.e. of move sequences of that length
+        captures        # of those moves pushing off a red marble
+        push_offs       # of those moves pushing off an opponent's marble
+        ko_rejections   # of pushes legal but for the ko rule (or superko), rejected by make_move
+        wins            # of those moves winning the game
+    The game is left as it was. Won games are not searched any further.
+    '''
+    if counts == None:
+        counts = new_counts(depth)
+    if depth == 0:
+        return counts
+    if player_name == None:
+        player = game.get_current_turn() or game.get_player1()
+        player_name = player.get_player_name()
+    ply_counts = counts[ply]
+    for coordinates, direction in game.legal_moves(player_name, ko_rule=False):
+        captured = game.get_captured(player_name)
+        marbles = sum(game.get_marble_count())
+        if not game.apply_move(player_name, coordinates, direction):
+            ply_counts['ko_rejections'] += 1
+            continue
+        ply_counts['nodes'] += 1
+        if game.get_captured(player_name) > captured:
+            ply_counts['captures'] += 1
+        elif sum(game.get_marble_count()) < marbles:
+            ply_counts['push_offs'] += 1
+        if game.get_winner() != None:
+            ply_counts['wins'] += 1
+        elif depth > 1:
+            perft(game, depth - 1, game.get_current_turn().get_player_name(), counts, ply + 1)
+        game.undo_move()
+    return counts
+
+def perft_subtree(task):
+    '''
+    Takes a (game bytes, player name, move, depth) task and returns the counts of the
+    subtree below the move, offset by one ply (the move itself is counted by the caller)
+    '''
+    data, player_name, (coordinates, direction), depth = task
+    game = KubaGame.from_bytes(data)
+    game.make_move(player_name, coordinates, direction)
+    counts = new_counts(depth)
+    if game.get_winner() == None:
+        perft(game, depth - 1, game.get_current_turn().get_player_name(), counts, 1)
+    return counts
+
+def parallel_perft(game, depth, player_name=None, processes=None):
+    '''
+    Same as perft, but the subtree of each move of the first ply is counted in a process
+    pool. Returns (counts, seconds, positions per second), where the positions are the
+    nodes of every ply.
+    '''
+    from multiprocessing import Pool
+    start = time.perf_counter()
+    if player_name == None:
+        player = game.get_current_turn() or game.get_player1()
+        player_name = player.get_player_name()
+    # Count the first ply here, and send the subtree of each accepted move to the pool
+    counts = perft(game, min(depth, 1), player_name) + new_counts(depth - 1)
+    data = game.to_bytes()
+    tasks = []
+    if depth > 1:
+        tasks = [(data, player_name, move, depth) for move in game.legal_moves(player_name)]
+    if tasks:
+        with Pool(processes) as pool:
+            for subtree_counts in pool.imap_unordered(perft_subtree, tasks):
+                add_counts(counts, subtree_counts)
+    elapsed = time.perf_counter() - start
+    positions = sum(ply_counts['nodes'] for ply_counts in counts)
+    return counts, elapsed, positions / elapsed if elapsed > 0 else 0.0
+
+def compare_counts(counts, reference):
+    '''
+    Compares the per-ply counts against reference counts (only the plies in both are
+    compared) and returns a list of mismatches as (ply, kind, reference count, count)
+    '''
+    mismatches = []
+    for ply, (ply_counts, reference_counts) in enumerate(zip(counts, reference), 1):
+        for kind in COUNTS:
+            if kind in reference_counts and ply_counts[kind] != reference_counts[kind]:
+                mismatches.append((ply, kind, reference_counts[kind], ply_counts[kind]))
+    return mismatches
+
+def main(argv):
+    '''
+    Runs perft from the command line, i.e.
+        python KubaPerft.py 4 --check
+        python KubaPerft.py 3 --position game.bin --player PlayerB --save-reference game.json
+    Prints the counts of each ply and the positions per second. Exits with status 1 if
+    the counts differ from the reference counts.
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(prog='KubaPerft.py', description='Count Kuba move sequences to a depth')
+    parser.add_argument('depth', type=int)
+    parser.add_argument('--position', help='start from the game stored in this file (KubaGame.to_bytes)')
+    parser.add_argument('--player', help='name of the player to move (default: current turn, or player1)')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--check', action='store_true', help='compare against REFERENCE_COUNTS (initial setup only)')
+    parser.add_argument('--reference', help='compare against the counts stored in this JSON file')
+    parser.add_argument('--save-reference', help='store the counts in this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.position:
+        with open(args.position, 'rb') as position_file:
+            game = KubaGame.from_bytes(position_file.read())
+    else:
+        game = KubaGame(('PlayerA', 'W'), ('PlayerB', 'B'))
+    counts, elapsed, positions_per_sec = parallel_perft(game, args.depth, args.player, args.processes)
+    for ply, ply_counts in enumerate(counts, 1):
+        print('ply %d: %s' % (ply, ', '.join('%s %d' % (kind, ply_counts[kind]) for kind in COUNTS)))
+    print('%.2f s, %.0f positions/s' % (elapsed, positions_per_sec))
+    if args.save_reference:
+        with open(args.save_reference, 'w') as output:
+            output.write(json.dumps(counts, indent=2) + '\n')
+    reference = None
+    if args.reference:
+        with open(args.reference) as reference_file:
+            reference = json.load(reference_file)
+    elif args.check:
+        reference = REFERENCE_COUNTS
+    if reference != None:
+        mismatches = compare_counts(counts, reference)
+        for ply, kind, expected, count in mismatches:
+            sys.stderr.write('MISMATCH ply %d %s: %d expected, %d counted\n' % (ply, kind, expected, count))
+        if mismatches:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,146 @@
+import json     # Import to read the game records and write the reports
+import sys      # Import to read records from stdin and parse the command line
+
+from KubaGame import KubaGame
+
+def rejection_reason(game, player_name, coordinates, direction):
+    '''
+    Takes a move that make_move rejected and returns the reason as a short string
+    (one of KubaGame.REJECTION_REASONS).
+    '''
+    return game.check_moves(player_name, [(coordinates, direction)])[0]['reason']
+
+def is_move(move):
+    '''
+    Takes one entry of the "moves" of a game record and returns whether it has the shape of
+    a move: a [player name, [row, col], direction] entry with integer row and col
+    '''
+    if not isinstance(move, (list, tuple)) or len(move) != 3:
+        return False
+    player_name, coordinates, direction = move
+    return (isinstance(player_name, str) and isinstance(direction, str)
+            and isinstance(coordinates, (list, tuple)) and len(coordinates) == 2
+            and all(isinstance(value, int) and not isinstance(value, bool) for value in coordinates))
+
+def replay_record(line):
+    '''
+    Takes one game record (a JSON line with "players" as two [name, color] pairs, "moves"
+    as [player name, [row, col], direction] entries, and optionally "game_id", "superko",
+    and the "size", "setup" (list of rows) and "capture_target" of the board) and
+    replays it through KubaGame.make_move. Rejected moves are skipped like in a live game,
+    and so are entries that are not moves at all (see is_move), with the reason 'bad move'.
+    Returns a report with the first illegal move, the ko rule violations, and the final
+    winner and red marbles captured, or an error report if the record cannot be replayed.
+    '''
+    record = None
+    try:
+        record = json.loads(line)
+        return replay_game(record)
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as error:
+        game_id = record.get('game_id') if isinstance(record, dict) else None
+        return {'game_id': game_id, 'error': 'bad record: %s' % error}
+
+def replay_game(record):
+    '''Replays a parsed game record and returns its report (see replay_record)'''
+    players = [tuple(player) for player in record['players']]
+    moves = list(record['moves'])
+    game = KubaGame(players[0], players[1], superko=record.get('superko', False), size=record.get('size'),
+                    setup=record.get('setup'), capture_target=record.get('capture_target'))
+    first_illegal = None
+    ko_violations = []
+    accepted = 0
+    for index, move in enumerate(moves):
+        if not is_move(move):
+            if first_illegal == None:
+                first_illegal = {'index': index, 'move': move, 'reason': 'bad move'}
+            continue
+        player_name, coordinates, direction = move
+        coordinates = tuple(coordinates)
+        if game.make_move(player_name, coordinates, direction):
+            accepted += 1
+            continue
+        reason = rejection_reason(game, player_name, coordinates, direction)
+        if reason == 'ko rule':
+            ko_violations.append(index)
+        if first_illegal == None:
+            first_illegal = {'index': index, 'move': [player_name, list(coordinates), direction], 'reason': reason}
+    return {
+        'game_id': record.get('game_id'),
+        'moves': len(moves),
+        'accepted': accepted,
+        'first_illegal': first_illegal,
+        'ko_violations': ko_violations,
+        'winner': game.get_winner(),
+        'captured': {name: game.get_captured(name) for name, _ in players},
+    }
+
+def replay_chunk(lines):
+    '''Replays a list of game records (used by the worker processes)'''
+    return [replay_record(line) for line in lines]
+
+def read_chunks(lines, chunk_size):
+    '''Lazily groups the lines (or other records) into lists of chunk_size, leaving out blank lines'''
+    chunk = []
+    for line in lines:
+        if isinstance(line, str) and not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def map_chunks(function, tasks, workers=1):
+    '''
+    Lazily yields function(task) for every task, in input order. With workers > 1 the
+    tasks are spread over a process pool, with at most two tasks per worker in flight,
+    so memory stays bounded however many tasks the iterable yields.
+    '''
+    if workers <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(function, task))
+            # Wait for the oldest task before reading more of the input
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def replay_stream(lines, workers=1, chunk_size=256):
+    '''
+    Takes an iterable of game record lines (i.e. an open file or sys.stdin) and yields
+    one report per game, in input order. Records are read lazily and with workers > 1
+    the replay is spread over a process pool. At most a few chunks per worker are in
+    flight at a time, so memory stays bounded however long the input is.
+    '''
+    for reports in map_chunks(replay_chunk, read_chunks(lines, chunk_size), workers):
+        yield from reports
+
+def main(argv):
+    '''
+    Replays game records from a JSONL file (or stdin with "-" or no file) and prints one
+    JSON report per game, i.e. "python KubaReplay.py games.jsonl --workers 8".
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(prog='KubaReplay.py', description='Replay and validate Kuba game records')
+    parser.add_argument('records', nargs='?', default='-', help='JSONL file of game records (default: stdin)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args(argv)
+    source = sys.stdin if args.records == '-' else open(args.records)
+    try:
+        for report in replay_stream(source, args.workers, args.chunk_size):
+            sys.stdout.write(json.dumps(report) + '\n')
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
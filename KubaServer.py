@@ -0,0 +1,344 @@
+import asyncio  # Import to serve many connections from one thread
+import json     # Import for the line-delimited JSON protocol
+import sys      # Import to parse the command line
+import time     # Import to measure move latencies
+import uuid     # Import to generate game IDs
+from collections import deque
+
+from KubaGame import KubaGame
+from KubaInstrumentation import KubaInstrumentation
+
+class GameSession:
+    '''
+    GameSession holds one hosted KubaGame along with its subscribers (connections that
+    receive the game's move events, see KubaGame.add_observer), a lock so moves on the
+    game are applied one at a time and in order, and the time of its last move for idle
+    eviction.
+    '''
+
+    def __init__(self, game_id, game, now):
+        '''Takes the game ID, the KubaGame and the current (event loop) time'''
+        self.game_id = game_id
+        self.game = game
+        self.lock = asyncio.Lock()
+        self.subscribers = set()
+        self.last_active = now
+        game.add_observer(self.publish)
+
+    def publish(self, event):
+        '''Observer of the game: encodes the move event once and queues it to every subscriber'''
+        if not self.subscribers:
+            return
+        event['game_id'] = self.game_id
+        data = (json.dumps(event) + '\n').encode()
+        for connection in list(self.subscribers):
+            if not connection.push_data(data):
+                self.subscribers.discard(connection)
+
+    def get_keyframe(self):
+        '''Returns the game's current keyframe event, sent to a new subscriber'''
+        event = self.game.get_keyframe()
+        event['game_id'] = self.game_id
+        return event
+
+    def get_update(self):
+        '''Returns the reply to a "state" request: board, turn, captured counts and winner'''
+        game = self.game
+        current_turn = game.get_current_turn()
+        return {
+            'event': 'update',
+            'game_id': self.game_id,
+            'board': [''.join(row) for row in game.get_board().get_board_state().values()],
+            'turn': current_turn.get_player_name() if current_turn else None,
+            'captured': {player.get_player_name(): game.get_captured(player.get_player_name())
+                         for player in (game.get_player1(), game.get_player2())},
+            'winner': game.get_winner(),
+        }
+
+class Connection:
+    '''
+    Connection wraps one client socket. Outgoing messages go through a bounded queue
+    written out by its own task; replies wait for room in the queue (so a client that
+    does not read stops being read from), while updates to a subscriber whose queue is
+    full close that connection instead of holding up the game.
+    '''
+
+    def __init__(self, reader, writer, queue_size):
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size)
+        self.subscriptions = set()
+        self.closed = False
+
+    async def write_loop(self):
+        '''Writes the queued messages to the socket until the connection is closed'''
+        try:
+            while True:
+                message = await self.queue.get()
+                if message == None:
+                    break
+                self.writer.write(message)
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.closed = True
+            self.writer.close()
+
+    async def send(self, message):
+        '''Queues a reply, waiting while the queue is full'''
+        if not self.closed:
+            await self.queue.put((json.dumps(message) + '\n').encode())
+
+    def push(self, message):
+        '''Queues an update without waiting. Return False (and close) if the client is too slow'''
+        return self.push_data((json.dumps(message) + '\n').encode())
+
+    def push_data(self, data):
+        '''Same as push for an update already encoded as a line of JSON'''
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            self.close()
+            return False
+
+    def close(self):
+        '''Closes the connection once the messages already written are flushed'''
+        self.closed = True
+        self.writer.close()
+
+class KubaServer:
+    '''
+    KubaServer hosts many KubaGame instances behind a line-delimited JSON protocol over
+    TCP. Every request is one JSON object per line with an "op" (and an optional "id"
+    echoed back in the reply):
+
+        {"op": "create", "players": [["A", "W"], ["B", "B"]], "game_id": optional, "superko": false,
+         "size": optional, "setup": optional list of rows, "capture_target": optional}
+        {"op": "move", "game_id": ..., "player": "A", "coordinates": [6, 5], "direction": "F"}
+        {"op": "state", "game_id": ...}
+        {"op": "legal_moves", "game_id": ..., "player": "A"}
+        {"op": "check_moves", "game_id": ..., "player": "A", "moves": [[[6, 5], "F"], ...]}
+        {"op": "subscribe", "game_id": ...} / {"op": "unsubscribe", "game_id": ...}
+        {"op": "close", "game_id": ...}
+        {"op": "stats"}
+
+    Subscribers get the game's move events (KubaGame.add_observer) with its "game_id":
+    a keyframe of the whole game when they subscribe, then a delta event with the changed
+    cells after every accepted move, and another keyframe every so often. Events carry
+    a sequence # so a client can tell it missed one and ask for the "state". Games
+    without a move for idle_timeout seconds are evicted; with hibernate_after, games
+    without a move for that many seconds are hibernated (KubaGame.hibernate) until their
+    next request. Move latencies are kept so "stats" can report p50/p99. With instrument=True,
+    every hosted game records its make_move stage timings and rejection reasons on one
+    shared KubaInstrumentation, whose snapshot "stats" reports as well.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, idle_timeout=600.0, queue_size=256, instrument=False,
+                 hibernate_after=None):
+        self._host = host
+        self._port = port
+        self._idle_timeout = idle_timeout
+        self._hibernate_after = hibernate_after
+        self._queue_size = queue_size
+        self._sessions = {}                 # Game ID -> GameSession
+        self._connections = set()           # Open client connections
+        self._latencies = deque(maxlen=10000)   # Latency (seconds) of the latest moves
+        self._moves = 0
+        self._instrumentation = KubaInstrumentation() if instrument else None
+        self._server = None
+        self._evict_task = None
+
+    def get_sessions(self):
+        '''Returns the dictionary of hosted games by game ID'''
+        return self._sessions
+
+    async def start(self):
+        '''Starts listening and the idle eviction task. Returns the (host, port) listened on'''
+        self._server = await asyncio.start_server(self.handle_connection, self._host, self._port)
+        self._evict_task = asyncio.get_running_loop().create_task(self.evict_idle_games())
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        '''Starts the server (if not started yet) and serves until cancelled'''
+        if self._server == None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        '''Stops accepting connections, closes the open ones and stops the eviction task'''
+        if self._evict_task != None:
+            self._evict_task.cancel()
+        if self._server != None:
+            self._server.close()
+            for connection in list(self._connections):
+                connection.close()
+            await self._server.wait_closed()
+
+    async def evict_idle_games(self):
+        '''
+        Periodically removes the games that have been idle for longer than idle_timeout,
+        and hibernates those idle for longer than hibernate_after. A game that fails to
+        hibernate is logged to stderr and evicted, so one bad game never stops the task.
+        '''
+        loop = asyncio.get_running_loop()
+        interval = min(self._idle_timeout, self._hibernate_after or self._idle_timeout)
+        while True:
+            await asyncio.sleep(max(interval / 4, 0.01))
+            now = loop.time()
+            for game_id, session in list(self._sessions.items()):
+                if now - session.last_active > self._idle_timeout:
+                    self.remove_session(session, 'evicted')
+                elif self._hibernate_after != None and now - session.last_active > self._hibernate_after:
+                    try:
+                        session.game.hibernate()
+                    except Exception as error:
+                        sys.stderr.write('Could not hibernate game %s, evicting it: %r\n' % (game_id, error))
+                        self.remove_session(session, 'evicted')
+
+    def remove_session(self, session, reason):
+        '''Removes a game from the registry and tells its subscribers why'''
+        self._sessions.pop(session.game_id, None)
+        for connection in list(session.subscribers):
+            connection.push({'event': reason, 'game_id': session.game_id})
+            connection.subscriptions.discard(session.game_id)
+        session.subscribers.clear()
+
+    async def handle_connection(self, reader, writer):
+        '''Reads requests from one client until it disconnects'''
+        connection = Connection(reader, writer, self._queue_size)
+        self._connections.add(connection)
+        write_task = asyncio.get_running_loop().create_task(connection.write_loop())
+        try:
+            while not connection.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    reply = await self.handle_request(connection, request)
+                except (ValueError, KeyError, TypeError, IndexError, AttributeError) as error:
+                    reply = {'ok': False, 'error': 'bad request: %s' % error}
+                if isinstance(request, dict) and 'id' in request:
+                    reply['id'] = request['id']
+                await connection.send(reply)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for game_id in connection.subscriptions:
+                session = self._sessions.get(game_id)
+                if session != None:
+                    session.subscribers.discard(connection)
+            self._connections.discard(connection)
+            # Let the write task flush what is queued, then stop it
+            if not connection.queue.full():
+                connection.queue.put_nowait(None)
+            await asyncio.wait([write_task], timeout=1.0)
+            write_task.cancel()
+
+    async def handle_request(self, connection, request):
+        '''Takes a decoded request and returns the reply'''
+        op = request['op']
+        if op == 'create':
+            return self.create_game(request)
+        elif op == 'stats':
+            return self.get_stats()
+        session = self._sessions.get(request['game_id'])
+        if session == None:
+            return {'ok': False, 'error': 'unknown game'}
+        if op == 'move':
+            return await self.make_move(session, request)
+        elif op == 'state':
+            reply = session.get_update()
+            del reply['event']
+            reply['ok'] = True
+            return reply
+        elif op == 'legal_moves':
+            moves = session.game.legal_moves(request['player'])
+            return {'ok': True, 'moves': [[list(coordinates), direction] for coordinates, direction in moves]}
+        elif op == 'check_moves':
+            moves = [(tuple(coordinates), direction) for coordinates, direction in request['moves']]
+            return {'ok': True, 'results': session.game.check_moves(request['player'], moves)}
+        elif op == 'subscribe':
+            if connection not in session.subscribers:
+                connection.push(session.get_keyframe())
+            session.subscribers.add(connection)
+            connection.subscriptions.add(session.game_id)
+            return {'ok': True}
+        elif op == 'unsubscribe':
+            session.subscribers.discard(connection)
+            connection.subscriptions.discard(session.game_id)
+            return {'ok': True}
+        elif op == 'close':
+            self.remove_session(session, 'closed')
+            return {'ok': True}
+        return {'ok': False, 'error': 'unknown op %r' % op}
+
+    def create_game(self, request):
+        '''Creates a new game from a "create" request and returns its game ID'''
+        game_id = request.get('game_id') or uuid.uuid4().hex
+        if game_id in self._sessions:
+            return {'ok': False, 'error': 'game already exists'}
+        player1, player2 = (tuple(player) for player in request['players'])
+        game = KubaGame(player1, player2, superko=request.get('superko', False), size=request.get('size'),
+                        setup=request.get('setup'), capture_target=request.get('capture_target'))
+        game.set_instrumentation(self._instrumentation)
+        self._sessions[game_id] = GameSession(game_id, game, asyncio.get_running_loop().time())
+        return {'ok': True, 'game_id': game_id}
+
+    async def make_move(self, session, request):
+        '''Applies a "move" request to the game (one at a time per game); the session publishes its events'''
+        start = time.perf_counter()
+        async with session.lock:
+            accepted = session.game.make_move(request['player'], tuple(request['coordinates']), request['direction'])
+            if accepted:
+                session.last_active = asyncio.get_running_loop().time()
+        self._latencies.append(time.perf_counter() - start)
+        self._moves += 1
+        return {'ok': accepted, 'winner': session.game.get_winner()}
+
+    def get_stats(self):
+        '''
+        Returns the # of hosted games (and how many are hibernated), # of moves handled and
+        the p50/p99 move latency (ms), plus the make_move instrumentation snapshot if the
+        server is instrumented.
+        '''
+        latencies = sorted(self._latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return 0.0
+            return 1000 * latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        stats = {'ok': True, 'games': len(self._sessions), 'moves': self._moves,
+                 'hibernated': sum(1 for session in self._sessions.values() if session.game.is_hibernated()),
+                 'p50_ms': percentile(0.50), 'p99_ms': percentile(0.99)}
+        if self._instrumentation != None:
+            stats['instrumentation'] = self._instrumentation.get_snapshot()
+        return stats
+
+def main(argv):
+    '''Runs the server from the command line, i.e. "python KubaServer.py --port 8765"'''
+    import argparse
+    parser = argparse.ArgumentParser(prog='KubaServer.py', description='Host Kuba games over line-delimited JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--idle-timeout', type=float, default=600.0)
+    parser.add_argument('--queue-size', type=int, default=256)
+    parser.add_argument('--instrument', action='store_true', help='report make_move stage timings and rejections in stats')
+    parser.add_argument('--hibernate-after', type=float, default=None, help='hibernate games idle for this many seconds')
+    args = parser.parse_args(argv)
+    server = KubaServer(args.host, args.port, args.idle_timeout, args.queue_size, args.instrument,
+                        args.hibernate_after)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,122 @@
+from KubaGame import DIRECTIONS, ZOBRIST_KEYS, ZOBRIST_TURN_KEYS, ZOBRIST_CAPTURE_KEYS
+
+# The push rules treat every row, column and direction alike, so a position plays the same
+# after any of the 8 symmetries of the square board, and after swapping the W/B colors
+# (the initial setup maps onto itself by a 180 degree rotation with the colors swapped).
+# A transform is a number 0-15: transform % 8 is the symmetry below, transform >= 8 swaps W/B.
+SYMMETRIES = (
+    lambda row, col: (row, col),            # 0 identity
+    lambda row, col: (col, 6 - row),        # 1 rotate 90 degrees clockwise
+    lambda row, col: (6 - row, 6 - col),    # 2 rotate 180 degrees
+    lambda row, col: (6 - col, row),        # 3 rotate 270 degrees clockwise
+    lambda row, col: (row, 6 - col),        # 4 mirror left/right
+    lambda row, col: (6 - row, col),        # 5 mirror top/bottom
+    lambda row, col: (col, row),            # 6 mirror on the main diagonal
+    lambda row, col: (6 - col, 6 - row),    # 7 mirror on the anti-diagonal
+)
+INVERSE_SYMMETRIES = (0, 3, 2, 1, 4, 5, 6, 7)
+SWAP_COLORS = {'W': 'B', 'B': 'W', 'R': 'R', None: None}
+
+def build_symmetry_tables():
+    '''
+    Returns the tables used by get_canonical_key:
+        cell_maps       cell index -> transformed cell index, per symmetry
+        direction_maps  direction -> transformed direction, per symmetry
+        row_keys        per transform, color (W, B, R) and row, the Zobrist hash of the
+                        transformed cells for each of the 128 values of the row's 7 bits
+    '''
+    cell_maps = []
+    direction_maps = []
+    for symmetry in SYMMETRIES:
+        cell_map = []
+        for index in range(49):
+            row, col = symmetry(*divmod(index, 7))
+            cell_map.append(row * 7 + col)
+        cell_maps.append(tuple(cell_map))
+        direction_map = {}
+        for direction, (row_step, col_step) in DIRECTIONS.items():
+            # The step between the transformed center cell and the transformed cell next to it
+            center = symmetry(3, 3)
+            moved = symmetry(3 + row_step, 3 + col_step)
+            step = (moved[0] - center[0], moved[1] - center[1])
+            direction_map[direction] = next(name for name, value in DIRECTIONS.items() if value == step)
+        direction_maps.append(direction_map)
+    row_keys = []
+    for transform in range(16):
+        cell_map = cell_maps[transform % 8]
+        color_keys = []
+        for color in ('W', 'B', 'R'):
+            keys = ZOBRIST_KEYS[SWAP_COLORS[color] if transform >= 8 else color]
+            rows = []
+            for row in range(7):
+                table = [0] * 128
+                for bits in range(1, 128):
+                    low_bit = bits & -bits
+                    table[bits] = table[bits ^ low_bit] ^ keys[cell_map[row * 7 + low_bit.bit_length() - 1]]
+                rows.append(table)
+            color_keys.append(rows)
+        row_keys.append(color_keys)
+    return tuple(cell_maps), tuple(direction_maps), row_keys
+
+CELL_MAPS, DIRECTION_MAPS, ROW_KEYS = build_symmetry_tables()
+
+def get_canonical_key(game, player_name=None):
+    '''
+    Takes a game (and the player to move if no-one has made a move yet) and returns
+    (key, transform): the smallest get_position_hash over the 16 transforms of the
+    position (board, color to move and red marbles captured by each color), and the
+    transform that gives it. Positions that are the same up to symmetry and W/B swap get
+    the same key. Like get_position_hash, the key does not cover the ko boards.
+    Use to_canonical_move / from_canonical_move to map moves to and from the key's frame.
+    Raises ValueError for boards other than 7x7.
+    '''
+    if game.get_board().get_size() != 7:
+        raise ValueError('Canonical keys are only defined for 7x7 boards')
+    if player_name == None and game.get_current_turn() != None:
+        player_name = game.get_current_turn().get_player_name()
+    color = game.identify_player(player_name).get_player_color() if player_name != None else None
+    captured = {game.get_player1().get_player_color(): game.get_player1_count(),
+                game.get_player2().get_player_color(): game.get_player2_count()}
+    return get_canonical_state_key(game.get_board().get_packed_state(), color, captured)
+
+def get_canonical_state_key(packed_state, color=None, captured=None):
+    '''
+    Same as get_canonical_key for a packed (white, black, red) board, the color of the
+    player to move (None if unknown) and the red marbles captured by color, i.e. {'W': 2, 'B': 0}.
+    '''
+    captured = captured or {'W': 0, 'B': 0}
+    # Split each color's bits into its 7 rows once, then look up every transform
+    rows = [[(color_bits >> (row * 7)) & 127 for row in range(7)] for color_bits in packed_state]
+    best_key = None
+    best_transform = 0
+    for transform in range(16):
+        key = 0
+        for color_rows, color_keys in zip(rows, ROW_KEYS[transform]):
+            for row_bits, row_table in zip(color_rows, color_keys):
+                key ^= row_table[row_bits]
+        if transform >= 8:
+            key ^= ZOBRIST_TURN_KEYS[SWAP_COLORS[color]]
+            key ^= ZOBRIST_CAPTURE_KEYS['W'][captured['B']] ^ ZOBRIST_CAPTURE_KEYS['B'][captured['W']]
+        else:
+            key ^= ZOBRIST_TURN_KEYS[color]
+            key ^= ZOBRIST_CAPTURE_KEYS['W'][captured['W']] ^ ZOBRIST_CAPTURE_KEYS['B'][captured['B']]
+        if best_key == None or key < best_key:
+            best_key, best_transform = key, transform
+    return best_key, best_transform
+
+def transform_move(move, transform):
+    '''Takes a (coordinates, direction) move and returns it with the symmetry of the transform applied'''
+    (row, col), direction = move
+    return SYMMETRIES[transform % 8](row, col), DIRECTION_MAPS[transform % 8][direction]
+
+def inverse_transform(transform):
+    '''Returns the transform that undoes the given one'''
+    return INVERSE_SYMMETRIES[transform % 8] + (transform & 8)
+
+def to_canonical_move(move, transform):
+    '''Takes a move of the game and the transform from get_canonical_key and returns the move in the key's frame'''
+    return transform_move(move, transform)
+
+def from_canonical_move(move, transform):
+    '''Takes a move in the key's frame and the transform from get_canonical_key and returns the move in the game'''
+    return transform_move(move, inverse_transform(transform))
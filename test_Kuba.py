@@ -0,0 +1,516 @@
+import os           # Import to build paths in the temporary directories
+import random       # Import to play random games
+import shutil       # Import to remove the temporary directories
+import tempfile     # Import for scratch directories of the file formats
+import unittest     # Import for the test cases
+
+from KubaGame import KubaGame, DIRECTIONS
+from KubaArchive import KubaArchiveWriter, KubaArchiveReader
+from KubaBook import KubaBook, get_book_key
+from KubaJournal import KubaJournal
+from KubaReplay import replay_record, replay_stream
+from KubaSymmetry import to_canonical_move
+
+try:
+    import numpy    # Import to check whether KubaBatch can run (pip install numpy)
+except ImportError:
+    numpy = None
+
+# Official setup, written out here so the reference rules do not depend on KubaBoard
+OFFICIAL_SETUP = ['WWXXXBB', 'WWXRXBB', 'XXRRRXX', 'XRRRRRX', 'XXRRRXX', 'BBXRXWW', 'BBXXXWW']
+
+class ReferenceKuba:
+    '''
+    Straightforward implementation of the original rules on a list of rows, used to
+    check KubaGame against: a move pushes the player's own marble (the cell it is pushed
+    from must be empty or off the board) and the line in front of it up to the first
+    empty cell, or pushes the last marble of the line off the board. A player may not
+    push off their own marble, undo the opponent's last move (ko rule) or, with
+    superko, repeat any earlier board. A player wins by capturing 7 red marbles, by
+    pushing off all of the opponent's marbles, or when the opponent has no legal move.
+    '''
+
+    def __init__(self, player1, player2, superko=False):
+        self.players = [player1, player2]
+        self.colors = dict(self.players)
+        self.board = [list(row) for row in OFFICIAL_SETUP]
+        self.previous = None        # Board before the last move (ko rule)
+        self.history = [self.board_key(self.board)]
+        self.superko = superko
+        self.turn = None
+        self.captured = {player1[0]: 0, player2[0]: 0}
+        self.winner = None
+
+    @staticmethod
+    def board_key(board):
+        return tuple(''.join(row) for row in board)
+
+    def opponent(self, name):
+        return self.players[1][0] if name == self.players[0][0] else self.players[0][0]
+
+    def push(self, name, coordinates, direction):
+        '''Returns (new board, marble pushed off) if the move is legal, else None'''
+        if name not in self.colors or self.winner != None or direction not in DIRECTIONS:
+            return None
+        if self.turn not in (None, name):
+            return None
+        row, col = coordinates
+        if not (0 <= row < 7 and 0 <= col < 7) or self.board[row][col] != self.colors[name]:
+            return None
+        row_step, col_step = DIRECTIONS[direction]
+        behind = (row - row_step, col - col_step)
+        if 0 <= behind[0] < 7 and 0 <= behind[1] < 7 and self.board[behind[0]][behind[1]] != 'X':
+            return None
+        run = []
+        while 0 <= row < 7 and 0 <= col < 7 and self.board[row][col] != 'X':
+            run.append((row, col))
+            row, col = row + row_step, col + col_step
+        board = [list(cells) for cells in self.board]
+        marbles = [self.board[cell_row][cell_col] for cell_row, cell_col in run]
+        if 0 <= row < 7 and 0 <= col < 7:
+            run.append((row, col))
+            popped = 'X'
+        else:
+            popped = marbles.pop()
+        for (cell_row, cell_col), marble in zip(run, ['X'] + marbles):
+            board[cell_row][cell_col] = marble
+        if popped == self.colors[name]:
+            return None
+        key = self.board_key(board)
+        if self.previous != None and key == self.board_key(self.previous):
+            return None
+        if self.superko and key in self.history:
+            return None
+        return board, popped
+
+    def legal_moves(self, name):
+        return {((row, col), direction) for row in range(7) for col in range(7) for direction in DIRECTIONS
+                if self.push(name, (row, col), direction) != None}
+
+    def make_move(self, name, coordinates, direction):
+        result = self.push(name, coordinates, direction)
+        if result == None:
+            return False
+        self.previous = self.board
+        self.board, popped = result
+        self.history.append(self.board_key(self.board))
+        if popped == 'R':
+            self.captured[name] += 1
+        self.turn = self.opponent(name)
+        counts = {color: sum(row.count(color) for row in self.board) for color in 'WB'}
+        color_names = {color: player_name for player_name, color in self.players}
+        for player_name, _ in self.players:
+            if self.captured[player_name] >= 7:
+                self.winner = player_name
+                break
+        if counts['W'] == 0:
+            self.winner = color_names['B']
+        elif counts['B'] == 0:
+            self.winner = color_names['W']
+        if self.winner == None and not self.legal_moves(self.turn):
+            self.winner = name
+        return True
+
+def random_move(rng, game, name):
+    '''Picks a move of one of the player's marbles, or (now and then) a move that is not valid at all'''
+    roll = rng.random()
+    if roll < 0.05:
+        return name, (rng.randrange(-1, 8), rng.randrange(-1, 8)), rng.choice('LRFBX')
+    if roll < 0.1:
+        name = game.get_player1().get_player_name() if rng.random() < 0.5 else game.get_player2().get_player_name()
+    color = game.identify_player(name).get_player_color()
+    board_state = game.get_board().get_board_state()
+    cells = [(row, col) for row in range(7) for col in range(7) if board_state[row + 1][col] == color]
+    return name, rng.choice(cells) if cells else (0, 0), rng.choice('LRFB')
+
+def player_to_move(game):
+    '''Returns the name of the player to move (player1 if anyone can start)'''
+    current_turn = game.get_current_turn()
+    return (current_turn or game.get_player1()).get_player_name()
+
+def play_random(game, rng, plies, on_move=None):
+    '''Plays up to plies random legal moves on the game with make_move'''
+    for _ in range(plies):
+        name = player_to_move(game)
+        moves = game.legal_moves(name)
+        if not moves or game.get_winner() != None:
+            return
+        coordinates, direction = rng.choice(moves)
+        game.make_move(name, coordinates, direction)
+        if on_move != None:
+            on_move(name, coordinates, direction)
+
+class TestRules(unittest.TestCase):
+    '''make_move, check_moves and legal_moves against the reference rules'''
+
+    def check_game(self, game, reference):
+        board_state = game.get_board().get_board_state()
+        self.assertEqual([''.join(board_state[row + 1]) for row in range(7)], [''.join(row) for row in reference.board])
+        counts = [sum(row.count(color) for row in reference.board) for color in 'WBR']
+        self.assertEqual(list(game.get_marble_count()), counts)
+        for name in reference.captured:
+            self.assertEqual(game.get_captured(name), reference.captured[name])
+        self.assertEqual(game.get_winner(), reference.winner)
+        current_turn = game.get_current_turn()
+        self.assertEqual(current_turn.get_player_name() if current_turn else None, reference.turn)
+
+    def play(self, seed, superko):
+        rng = random.Random(seed)
+        game = KubaGame(('A', 'W'), ('B', 'B'), superko=superko, debug=True)
+        reference = ReferenceKuba(('A', 'W'), ('B', 'B'), superko=superko)
+        for ply in range(300):
+            name, coordinates, direction = random_move(rng, game, player_to_move(game))
+            if ply % 10 == 0:
+                self.assertEqual(set(game.legal_moves(name)), reference.legal_moves(name))
+            expected = reference.make_move(name, coordinates, direction)
+            self.assertEqual(game.check_moves(name, [(coordinates, direction)])[0]['legal'], expected)
+            self.assertEqual(game.make_move(name, coordinates, direction), expected)
+            self.check_game(game, reference)
+            if reference.winner != None:
+                break
+
+    def test_random_games(self):
+        for seed in range(20):
+            self.play(seed, superko=False)
+
+    def test_random_games_superko(self):
+        for seed in range(10):
+            self.play(seed, superko=True)
+
+    def test_ko_rule(self):
+        rng = random.Random(0)
+        rejected = 0
+        for _ in range(20):
+            game = KubaGame(('A', 'W'), ('B', 'B'))
+            reference = ReferenceKuba(('A', 'W'), ('B', 'B'))
+            while game.get_winner() == None and game.get_game_counter() < 200:
+                name = player_to_move(game)
+                # Moves only the ko rule forbids: they would undo the opponent's last move
+                for coordinates, direction in set(game.legal_moves(name, ko_rule=False)) - set(game.legal_moves(name)):
+                    self.assertEqual(game.check_moves(name, [(coordinates, direction)])[0]['reason'], 'ko rule')
+                    self.assertFalse(game.make_move(name, coordinates, direction))
+                    self.assertFalse(reference.make_move(name, coordinates, direction))
+                    rejected += 1
+                coordinates, direction = rng.choice(game.legal_moves(name))
+                self.assertTrue(game.make_move(name, coordinates, direction))
+                self.assertTrue(reference.make_move(name, coordinates, direction))
+        self.assertGreater(rejected, 0)
+
+    def test_win_scenarios(self):
+        empty = ['XXXXXXX'] * 7
+        # Capturing the red marbles of the capture target
+        game = KubaGame(('A', 'W'), ('B', 'B'), setup=['RWXXXXX'] + empty[1:6] + ['XXXXXXB'], capture_target=1)
+        self.assertTrue(game.make_move('A', (0, 1), 'L'))
+        self.assertEqual((game.get_winner(), game.get_captured('A')), ('A', 1))
+        # Pushing off the opponent's last marble
+        game = KubaGame(('A', 'W'), ('B', 'B'), setup=['BWXXXXX'] + empty[1:6] + ['XXXXXXR'])
+        self.assertTrue(game.make_move('A', (0, 1), 'L'))
+        self.assertEqual(game.get_winner(), 'A')
+        # Leaving the opponent without a legal move
+        game = KubaGame(('A', 'W'), ('B', 'B'), setup=empty[:2] + ['XXXRXXX', 'XXRBRXX', 'XXXRXXX'] + empty[5:6] + ['XXXXXXW'])
+        self.assertTrue(game.make_move('A', (6, 6), 'F'))
+        self.assertEqual(game.get_winner(), 'A')
+        self.assertFalse(game.make_move('B', (3, 3), 'L'))
+
+    def test_turn_order(self):
+        game = KubaGame(('PlayerA', 'W'), ('PlayerB', 'B'))
+        self.assertTrue(game.make_move('PlayerA', (6, 5), 'F'))
+        self.assertFalse(game.make_move('PlayerA', (5, 5), 'F'))
+
+    def test_player_colors(self):
+        with self.assertRaises(ValueError):
+            KubaGame(('A', 'W'), ('B', 'Z'))
+        with self.assertRaises(ValueError):
+            KubaGame(('A', 'B'), ('B', 'B'))
+
+    def test_debug_count_drift(self):
+        game = KubaGame(('A', 'W'), ('B', 'B'), debug=True)
+        play_random(game, random.Random(1), 40)
+        game.get_board()._red_count += 1
+        with self.assertRaises(RuntimeError):
+            game.get_board().get_marble_count()
+
+class TestUndoAndFork(unittest.TestCase):
+    '''apply_move / undo_move and fork round trips'''
+
+    def test_apply_undo(self):
+        for superko in (False, True):
+            rng = random.Random(superko)
+            game = KubaGame(('A', 'W'), ('B', 'B'), superko=superko)
+            states = []
+            for _ in range(60):
+                name = player_to_move(game)
+                moves = game.legal_moves(name)
+                if not moves or game.get_winner() != None:
+                    break
+                states.append((game.to_bytes(), game.get_position_hash(), game.legal_moves(name)))
+                self.assertTrue(game.apply_move(name, *rng.choice(moves)))
+            while states:
+                self.assertTrue(game.undo_move())
+                data, position_hash, moves = states.pop()
+                self.assertEqual(game.to_bytes(), data)
+                self.assertEqual(game.get_position_hash(), position_hash)
+                self.assertEqual(game.legal_moves(player_to_move(game)), moves)
+            self.assertFalse(game.undo_move())
+
+    def test_fork(self):
+        game = KubaGame(('A', 'W'), ('B', 'B'), superko=True)
+        play_random(game, random.Random(2), 20)
+        data = game.to_bytes()
+        events = []
+        game.add_observer(events.append)
+        events.clear()
+        fork = game.fork()
+        self.assertEqual(fork.to_bytes(), data)
+        play_random(fork, random.Random(3), 20)
+        self.assertNotEqual(fork.to_bytes(), data)
+        self.assertEqual(game.to_bytes(), data)
+        self.assertEqual(events, [])
+        # The superko history is copied before either game changes it
+        name = player_to_move(game)
+        self.assertEqual(game.legal_moves(name), KubaGame.from_bytes(data).legal_moves(name))
+
+class TestBytes(unittest.TestCase):
+    '''to_bytes / from_bytes and hibernation'''
+
+    def round_trip(self, game):
+        copy = KubaGame.from_bytes(game.to_bytes())
+        self.assertEqual(copy.to_bytes(), game.to_bytes())
+        self.assertEqual(copy.get_board().get_board_state(), game.get_board().get_board_state())
+        self.assertEqual(copy.get_position_hash(), game.get_position_hash())
+        self.assertEqual(copy.get_capture_target(), game.get_capture_target())
+        self.assertEqual(copy.is_superko(), game.is_superko())
+        name = player_to_move(game)
+        self.assertEqual(copy.legal_moves(name), game.legal_moves(name))
+        return copy
+
+    def test_round_trip(self):
+        rng = random.Random(4)
+        for size, superko in ((7, False), (7, True), (5, False), (9, True), (11, False)):
+            game = KubaGame(('A', 'W'), ('B', 'B'), superko=superko, size=size)
+            for _ in range(10):
+                self.round_trip(game)
+                play_random(game, rng, 7)
+
+    def test_capture_target(self):
+        game = KubaGame(('A', 'W'), ('B', 'B'), capture_target=255)
+        self.assertEqual(self.round_trip(game).get_capture_target(), 255)
+        for capture_target in (0, 256, 300):
+            with self.assertRaises(ValueError):
+                KubaGame(('A', 'W'), ('B', 'B'), capture_target=capture_target)
+
+    def test_bad_bytes(self):
+        with self.assertRaises(ValueError):
+            KubaGame.from_bytes(b'\xff\x00\x07\x07')
+        data = KubaGame(('A', 'W'), ('B', 'B')).to_bytes()
+        with self.assertRaises(ValueError):
+            KubaGame.from_bytes(data[:len(data) // 2])
+
+    def test_hibernate(self):
+        game = KubaGame(('A', 'W'), ('B', 'B'), size=9)
+        play_random(game, random.Random(5), 15)
+        data = game.to_bytes()
+        game.hibernate()
+        self.assertTrue(game.is_hibernated())
+        self.assertEqual(game.to_bytes(), data)
+        self.assertFalse(game.is_hibernated())
+
+class TestObservers(unittest.TestCase):
+    '''The board rebuilt from the observer's keyframe and delta events matches the game'''
+
+    def test_rebuild_from_events(self):
+        game = KubaGame(('A', 'W'), ('B', 'B'))
+        game.set_keyframe_interval(5)
+        rebuilt = {}
+        seen = []
+
+        def observer(event):
+            if event['event'] == 'keyframe':
+                rebuilt['board'] = [list(row) for row in event['board']]
+                rebuilt['captured'] = dict(event['captured'])
+                rebuilt['seq'] = event['seq']
+                rebuilt['turn'] = event['turn']
+            else:
+                self.assertEqual(event['seq'], rebuilt['seq'] + 1)
+                for row, col, marble in event['cells']:
+                    rebuilt['board'][row][col] = marble
+                rebuilt['captured'].update(event.get('captured', {}))
+                rebuilt['seq'] = event['seq']
+                rebuilt['turn'] = event['turn']
+            seen.append(event['event'])
+
+        game.add_observer(observer)
+        self.assertEqual(seen, ['keyframe'])
+        rng = random.Random(6)
+        for _ in range(80):
+            name, coordinates, direction = random_move(rng, game, player_to_move(game))
+            game.make_move(name, coordinates, direction)
+            board_state = game.get_board().get_board_state()
+            self.assertEqual(rebuilt['board'], [board_state[row + 1] for row in range(7)])
+            self.assertEqual(rebuilt['captured'], {'A': game.get_captured('A'), 'B': game.get_captured('B')})
+            if game.get_winner() != None:
+                break
+        self.assertIn('delta', seen)
+        self.assertGreater(seen.count('keyframe'), 1)
+        game.remove_observer(observer)
+        count = len(seen)
+        play_random(game, rng, 3)
+        self.assertEqual(len(seen), count)
+
+    def test_undo_sends_keyframe(self):
+        game = KubaGame(('A', 'W'), ('B', 'B'))
+        events = []
+        game.add_observer(events.append)
+        self.assertTrue(game.apply_move('A', (6, 5), 'F'))
+        self.assertTrue(game.undo_move())
+        self.assertEqual([event['event'] for event in events], ['keyframe', 'delta', 'keyframe'])
+        self.assertEqual(events[-1]['board'], OFFICIAL_SETUP)
+
+@unittest.skipIf(numpy == None, 'KubaBatch needs numpy')
+class TestBatch(unittest.TestCase):
+    '''KubaBatch steps its games the same way as KubaGame.make_move'''
+
+    def test_batch_matches_game(self):
+        from KubaBatch import KubaBatch, WHITE, BLACK, MARBLE_CODES, DIRECTION_CODES
+        n_games = 16
+        rng = random.Random(7)
+        batch = KubaBatch(n_games)
+        games = [KubaGame(('A', 'W'), ('B', 'B')) for _ in range(n_games)]
+        for _ in range(120):
+            moves = [random_move(rng, game, player_to_move(game)) for game in games]
+            colors = [WHITE if name == 'A' else BLACK for name, _, _ in moves]
+            rows = [coordinates[0] for _, coordinates, _ in moves]
+            cols = [coordinates[1] for _, coordinates, _ in moves]
+            directions = [DIRECTION_CODES.get(direction, 4) for _, _, direction in moves]
+            valid, winners = batch.step(colors, rows, cols, directions)
+            for index, (game, move) in enumerate(zip(games, moves)):
+                self.assertEqual(bool(valid[index]), game.make_move(*move))
+                board_state = game.get_board().get_board_state()
+                expected = [[MARBLE_CODES[marble] for marble in board_state[row + 1]] for row in range(7)]
+                self.assertEqual(batch.get_boards()[index].tolist(), expected)
+                self.assertEqual(batch.get_captures()[index].tolist(), [game.get_captured('A'), game.get_captured('B')])
+                winner = game.get_winner()
+                self.assertEqual(int(winners[index]), 0 if winner == None else WHITE if winner == 'A' else BLACK)
+
+class TestJournal(unittest.TestCase):
+    '''Games restored from the journal match the live games'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_restore(self):
+        rng = random.Random(8)
+        journal = KubaJournal(self.directory, snapshot_interval=50)
+        games = {}
+        for index in range(5):
+            games['game%d' % index] = KubaGame(('A', 'W'), ('B', 'B'))
+            journal.register('game%d' % index, games['game%d' % index])
+        for _ in range(300):
+            game_id = rng.choice(sorted(games))
+            moves = games[game_id].legal_moves(player_to_move(games[game_id]))
+            if moves:
+                journal.make_move(game_id, player_to_move(games[game_id]), *rng.choice(moves))
+        journal.remove('game0')
+        del games['game0']
+        journal.flush()
+        # A record torn by a crash at the end of the journal is ignored
+        with open(journal.journal_path(journal._generation), 'ab') as journal_file:
+            journal_file.write(b'\x10\x00\x00')
+        restored = KubaJournal.restore(self.directory)
+        journal.close()
+        self.assertEqual(sorted(restored), sorted(games))
+        for game_id, game in games.items():
+            self.assertEqual(restored[game_id].to_bytes(), game.to_bytes())
+
+class TestArchive(unittest.TestCase):
+    '''Games written to an archive are read back move for move'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games.kuba')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_round_trip(self):
+        rng = random.Random(9)
+        recorded = []
+        with KubaArchiveWriter(self.path) as writer:
+            for index in range(10):
+                game = KubaGame(('A', 'W'), ('B', 'B'))
+                moves = []
+                play_random(game, rng, 30 + index * 10, lambda *move: moves.append(move))
+                writer.add_game(('A', 'W'), ('B', 'B'), moves)
+                recorded.append((moves, game.to_bytes()))
+        with KubaArchiveReader(self.path) as reader:
+            self.assertEqual(len(reader), len(recorded))
+            for index, (moves, data) in enumerate(recorded):
+                self.assertEqual(reader.get_moves(index), [tuple(move) for move in moves])
+                self.assertEqual(reader.get_game(index).to_bytes(), data)
+
+    def test_rejects_moves_off_the_format(self):
+        with KubaArchiveWriter(self.path) as writer:
+            for moves in ([('A', (8, 8), 'F')], [('A', (-1, 0), 'F')], [('A', (6, 6), 'X')]):
+                with self.assertRaises(ValueError):
+                    writer.add_game(('A', 'W'), ('B', 'B'), moves)
+            with self.assertRaises(ValueError):
+                writer.add_game(('A', 'W'), ('B', 'B'), [], size=9)
+
+class TestBook(unittest.TestCase):
+    '''Book entries survive save() and are shared by mirrored positions'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'book.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_save_and_lookup(self):
+        game = KubaGame(('A', 'W'), ('B', 'B'))
+        game.make_move('A', (6, 6), 'F')
+        # The same opening mirrored left to right, with the colors swapped
+        mirrored = KubaGame(('A', 'W'), ('B', 'B'))
+        mirrored.make_move('B', (6, 0), 'F')
+        move = ((0, 6), 'B')
+        key, transform = get_book_key(game, 'B')
+        self.assertEqual(get_book_key(mirrored, 'A')[0], key)
+        with KubaBook(self.path) as book:
+            book.add(key, to_canonical_move(move, transform), 12, 4)
+            book.save()
+        with KubaBook(self.path) as book:
+            self.assertEqual(len(book), 1)
+            self.assertEqual(book.lookup(game, 'B'), {'move': move, 'score': 12, 'depth': 4})
+            self.assertEqual(book.lookup(mirrored, 'A')['move'], ((0, 0), 'B'))
+            self.assertEqual(book.lookup(KubaGame(('A', 'W'), ('B', 'B'), size=9), 'A'), None)
+            with self.assertRaises(ValueError):
+                book.add(key, ((7, 0), 'L'), 0, 1)
+
+class TestReplay(unittest.TestCase):
+    '''Bad game records are reported, never end the replay'''
+
+    def test_bad_records(self):
+        lines = ['{"players": [["A", "W"], ["B", "Z"]], "moves": [["A", [6, 5], "F"]]}',
+                 '{"game_id": "g2", "players": [["A", "W"], ["B", "B"]], "moves": [["A", [6], "L"], ["A", [6, 5], "F"]]}',
+                 '{"players": [["A", "W"], ["B", "B"]], "moves": [["A", [6, 6]], ["A", ["x", 1], "F"]]}',
+                 '{"players": [["A", "W"]], "moves": []}',
+                 '{"players": 7',
+                 '',
+                 '{"game_id": "g6", "players": [["A", "W"], ["B", "B"]], "moves": [["A", [6, 5], "F"]]}']
+        reports = list(replay_stream(lines))
+        self.assertEqual(len(reports), 6)
+        self.assertEqual(reports[0]['game_id'], None)
+        self.assertTrue(reports[0]['error'].startswith('bad record'))
+        self.assertEqual(reports[1]['game_id'], 'g2')
+        self.assertEqual((reports[1]['accepted'], reports[1]['first_illegal']['reason']), (1, 'bad move'))
+        self.assertEqual((reports[2]['accepted'], reports[2]['first_illegal']['index']), (0, 0))
+        self.assertIn('error', reports[3])
+        self.assertIn('error', reports[4])
+        self.assertEqual((reports[5]['game_id'], reports[5]['accepted']), ('g6', 1))
+        self.assertEqual(replay_record(lines[0]), reports[0])
+
+if __name__ == '__main__':
+    unittest.main()